@@ -0,0 +1,223 @@
+"""
+Benchmark scenarios run by the run_benchmarks command.
+
+Each scenario gets a BenchmarkContext holding the loaded catalog and
+returns a dict of measurements. Latencies are reported in milliseconds
+as median, p95 and mean over the timed samples.
+
+The API scenarios repeat the same URLs, which the response cache would
+answer after the first sample. The cache is cleared before each of their
+samples, outside the timing, so they measure the uncached responses.
+"""
+import random
+import statistics
+import threading
+import time
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from library.models import Book, Favorite
+from library.renderers import FastJSONRenderer
+from library.rows import BookRowSerializer
+from library.serializers import BookSerializer, prefetch_book_relations
+from library.utils import recommend_books
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'samples': len(timings),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[round(0.95 * (len(timings) - 1))] * 1000, 3),
+        'mean_ms': round(statistics.fmean(timings) * 1000, 3),
+    }
+
+
+def timed(function, samples, setup=None):
+    """``samples`` timings of ``function``, each after an untimed ``setup``."""
+    timings = []
+    for _ in range(samples):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+class BenchmarkContext:
+    def __init__(self, catalog_file, books, samples, seed, import_options):
+        self.catalog_file = catalog_file
+        self.books = books
+        self.samples = samples
+        self.random = random.Random(seed)
+        self.import_options = import_options
+        self.client = APIClient()
+        self._book_ids = None
+
+    @property
+    def book_ids(self):
+        if self._book_ids is None:
+            self._book_ids = list(Book.objects.values_list('id', flat=True))
+        return self._book_ids
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        assert response.status_code == 200, (url, response.status_code)
+        return response
+
+    def make_user(self, favorites=0):
+        user = User.objects.create_user(
+            f'benchmark-{self.random.randrange(10 ** 12)}')
+        for book_id in self.random.sample(self.book_ids, favorites):
+            Favorite.objects.create(user=user, book_id=book_id)
+        return user
+
+
+def import_scenario(context):
+    started = time.perf_counter()
+    call_command('import_books', context.catalog_file, stdout=StringIO(),
+                 **context.import_options)
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': context.books,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(context.books / elapsed, 1),
+    }
+
+
+def book_list_scenario(context):
+    last_page = max(len(context.book_ids) // 10, 1)
+    return {
+        'first_page': timed(lambda: context.get('/api/books/'),
+                            context.samples, setup=cache.clear),
+        'deep_page': timed(
+            lambda: context.get('/api/books/', data={'page': last_page}),
+            context.samples, setup=cache.clear),
+    }
+
+
+def book_search_scenario(context):
+    terms = ['dragon', 'night king', 'silver', 'love war']
+    return {
+        term: timed(lambda: context.get('/api/books/', data={'search': term}),
+                    context.samples, setup=cache.clear)
+        for term in terms
+    }
+
+
+def book_detail_scenario(context):
+    return timed(
+        lambda: context.get(
+            f'/api/books/{context.random.choice(context.book_ids)}/'),
+        context.samples, setup=cache.clear)
+
+
+def favorite_create_scenario(context):
+    timings = []
+    while len(timings) < context.samples:
+        context.client.force_authenticate(context.make_user())
+        for book_id in context.random.sample(context.book_ids, 20):
+            started = time.perf_counter()
+            response = context.client.post('/api/favorites/', {'book': book_id})
+            timings.append(time.perf_counter() - started)
+            assert response.status_code == 201, response.status_code
+            if len(timings) >= context.samples:
+                break
+    context.client.force_authenticate(None)
+    return summarize(timings)
+
+
+def recommend_books_scenario(context):
+    users = [context.make_user(favorites=context.random.randint(1, 20))
+             for _ in range(min(context.samples, 20))]
+    return timed(lambda: recommend_books(context.random.choice(users)),
+                 context.samples)
+
+
+def book_serialization_scenario(context, rows=1000):
+    """Rows per second turned into JSON, by ModelSerializer and by rows."""
+    queryset = Book.objects.order_by('id')[:rows]
+    row_serializer = BookRowSerializer(BookSerializer)
+
+    def serializer_path():
+        books = prefetch_book_relations(queryset)
+        JSONRenderer().render(BookSerializer(books, many=True).data)
+
+    def row_path():
+        FastJSONRenderer().render(row_serializer.to_representation(
+            list(row_serializer.values(queryset))))
+
+    count = queryset.count()
+    results = {}
+    for name, function in [('serializer', serializer_path), ('rows', row_path)]:
+        timing = timed(function, max(context.samples // 10, 3))
+        timing['rows_per_sec'] = round(count / (timing['median_ms'] / 1000), 1)
+        results[name] = timing
+    return results
+
+
+def concurrent_reads_scenario(context):
+    """
+    Read latency while the catalog is imported again on another thread,
+    against the same reads on an idle database.
+    """
+    def read():
+        book_ids = context.random.sample(context.book_ids, 10)
+        list(Book.objects.filter(id__in=book_ids).values('id', 'title'))
+        list(Book.objects.order_by('-average_rating', 'id')
+             .values('id', 'title')[:10])
+
+    idle = timed(read, context.samples)
+
+    import_errors = []
+
+    def run_import():
+        try:
+            call_command('import_books', context.catalog_file,
+                         stdout=StringIO(), **context.import_options)
+        except Exception as error:
+            import_errors.append(repr(error))
+        finally:
+            connection.close()
+
+    importer = threading.Thread(target=run_import)
+    timings = []
+    failed_reads = 0
+    started = time.perf_counter()
+    importer.start()
+    while importer.is_alive():
+        read_started = time.perf_counter()
+        try:
+            read()
+        except OperationalError:
+            failed_reads += 1
+            continue
+        timings.append(time.perf_counter() - read_started)
+    importer.join()
+
+    return {
+        'idle': idle,
+        'during_import': summarize(timings) if timings else None,
+        'failed_reads': failed_reads,
+        'import_seconds': round(time.perf_counter() - started, 3),
+        'import_errors': import_errors,
+    }
+
+
+SCENARIOS = {
+    'import_books': import_scenario,
+    'book_list': book_list_scenario,
+    'book_search': book_search_scenario,
+    'book_detail': book_detail_scenario,
+    'book_serialization': book_serialization_scenario,
+    'favorite_create': favorite_create_scenario,
+    'recommend_books': recommend_books_scenario,
+    'concurrent_reads': concurrent_reads_scenario,
+}
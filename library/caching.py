@@ -0,0 +1,203 @@
+"""
+Version stamps and cached results kept in Django's cache framework.
+
+A version stamp is the time it was last bumped, in nanoseconds. Cache
+keys embed the stamps they depend on. Bumping a stamp therefore
+invalidates every entry built from it, and stale entries are never
+deleted explicitly, they expire.
+
+The catalog stamp is bumped by the commands that bulk load books, which
+bypass model signals. Saving or deleting a single book or author bumps
+that object's stamp and its model's list stamp instead, see signals.py.
+Those commands run in their own process, so the cache backend has to be
+shared with the server, see CACHES in the settings.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from library.models import Book
+from library.profiling import profile_section
+from library.routers import pin_to_primary
+from library.utils import recommend_books
+
+CATALOG_VERSION_KEY = 'version:catalog'
+RECOMMENDATION_HITS_KEY = 'recommendations:hits'
+RECOMMENDATION_MISSES_KEY = 'recommendations:misses'
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # add() keeps whichever stamp another process stored first
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    cache.set(key, time.time_ns(), None)
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    return [versions[key] if key in versions else get_version(key)
+            for key in keys]
+
+
+def favorites_version_key(user_id):
+    return f'version:favorites:{user_id}'
+
+
+def bump_catalog_version():
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def bump_favorites_version(user_id):
+    bump_version(favorites_version_key(user_id))
+
+
+def object_version_key(model, pk):
+    return f'version:{model._meta.label_lower}:{pk}'
+
+
+def list_version_key(model):
+    return f'version:{model._meta.label_lower}'
+
+
+def bump_object_version(model, pk):
+    bump_version(object_version_key(model, pk))
+    bump_version(list_version_key(model))
+
+
+def increment(key):
+    # Atomic on memcached and Redis. The file cache reads and rewrites the
+    # entry, so concurrent processes can lose a count
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def recommendation_cache_key(user_id, limit):
+    return 'recommendations:{}:{}:{}:{}'.format(
+        user_id, limit,
+        get_version(favorites_version_key(user_id)),
+        get_version(CATALOG_VERSION_KEY),
+    )
+
+
+def cached_recommend_books(user, limit=5):
+    """
+    recommend_books, served from the cache until the user's favorites or
+    the catalog change.
+    """
+    key = recommendation_cache_key(user.id, limit)
+    book_ids = cache.get(key)
+    if book_ids is not None:
+        increment(RECOMMENDATION_HITS_KEY)
+        books_by_id = Book.objects.in_bulk(book_ids)
+        return [books_by_id[book_id] for book_id in book_ids
+                if book_id in books_by_id]
+
+    increment(RECOMMENDATION_MISSES_KEY)
+    books = recommend_books(user, limit=limit)
+    cache.set(key, [book.id for book in books],
+              getattr(settings, 'RECOMMENDATION_CACHE_TIMEOUT', None))
+    return books
+
+
+def recommendation_cache_stats():
+    hits = cache.get(RECOMMENDATION_HITS_KEY, 0)
+    misses = cache.get(RECOMMENDATION_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else None,
+    }
+
+
+class CachedCatalogMixin:
+    """
+    Conditional GET and cached rendered bodies for list and retrieve.
+
+    The ETag and Last-Modified headers are derived from version stamps
+    only, so a request whose If-None-Match still matches gets a 304
+    without querying the database. Only JSON responses are cached, the
+    browsable API renders differently for each user. Bodies behind a
+    stamp bumped within REPLICA_PIN_SECONDS are read from the primary,
+    a replica may not have the change yet.
+    """
+
+    def list(self, request, *args, **kwargs):
+        model = self.queryset.model
+        return self.cached_response(
+            [CATALOG_VERSION_KEY, list_version_key(model)],
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        model = self.queryset.model
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        try:
+            # "01" and "1" are the same object and must share a stamp
+            pk = model._meta.pk.to_python(lookup)
+        except ValidationError:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(
+            [CATALOG_VERSION_KEY, object_version_key(model, pk)],
+            super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, version_keys, handler, request, *args, **kwargs):
+        versions = get_versions(version_keys)
+        etag = quote_etag(hashlib.md5(repr((
+            request.get_full_path(), request.accepted_media_type, versions,
+        )).encode()).hexdigest())
+        last_modified = max(versions) // 10 ** 9
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return self.add_validators(response, etag, last_modified)
+
+        cacheable = request.accepted_renderer.format == 'json'
+        key = f'response:{etag}'
+        cached = cache.get(key) if cacheable else None
+        if cached is not None:
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            return self.add_validators(response, etag, last_modified)
+
+        # The body is cached under the new stamps, it must not come from a
+        # replica that is still behind them
+        recent = time.time_ns() - max(versions) < (
+            getattr(settings, 'REPLICA_PIN_SECONDS', 5) * 10 ** 9)
+        with pin_to_primary(recent):
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            # Render now rather than after dispatch so the body can be
+            # stored
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            with profile_section('render'):
+                response.render()
+        if cacheable:
+            cache.set(key, (response.content, response['Content-Type']),
+                      getattr(settings, 'CATALOG_RESPONSE_CACHE_TIMEOUT', None))
+        return self.add_validators(response, etag, last_modified)
+
+    def add_validators(self, response, etag, last_modified):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept'])
+        return response
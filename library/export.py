@@ -0,0 +1,117 @@
+"""
+Streaming catalog export as NDJSON or CSV, optionally gzipped.
+
+Books are read with a chunked iterator, a server-side cursor on
+PostgreSQL, and serialized a batch at a time by BookRowSerializer, so the
+payloads are the same as /api/books/ and each batch costs one query for
+its authors. Memory use depends on the batch size, not the catalog size.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from library.models import Book
+from library.renderers import FastJSONRenderer
+from library.rows import BookRowSerializer
+from library.serializers import BookSerializer
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# Books serialized, and written out, at a time
+EXPORT_BATCH_SIZE = 1000
+
+
+class CatalogExport:
+    """
+    Iterable of the encoded export, in chunks of bytes. ``exported`` counts
+    the books written so far.
+    """
+
+    def __init__(self, export_format, compress=False,
+                 batch_size=EXPORT_BATCH_SIZE, queryset=None):
+        if export_format not in EXPORT_CONTENT_TYPES:
+            raise ValueError(f'Unknown export format {export_format!r}')
+        self.export_format = export_format
+        self.compress = compress
+        self.batch_size = batch_size
+        self.queryset = Book.objects.all() if queryset is None else queryset
+        self.row_serializer = BookRowSerializer(BookSerializer)
+        self.exported = 0
+
+    @property
+    def content_type(self):
+        if self.compress:
+            return 'application/gzip'
+        return EXPORT_CONTENT_TYPES[self.export_format]
+
+    @property
+    def filename(self):
+        suffix = '.gz' if self.compress else ''
+        return f'books.{self.export_format}{suffix}'
+
+    def __iter__(self):
+        encode = {'ndjson': self.encode_ndjson,
+                  'csv': self.encode_csv}[self.export_format]
+        chunks = encode(self.batches())
+        if self.compress:
+            chunks = gzip_chunks(chunks)
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+
+    def batches(self):
+        rows = self.row_serializer.values(
+            self.queryset.order_by('id')).iterator(chunk_size=self.batch_size)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield self.serialize(batch)
+                batch = []
+        if batch:
+            yield self.serialize(batch)
+
+    def serialize(self, rows):
+        payloads = self.row_serializer.to_representation(rows)
+        self.exported += len(payloads)
+        return payloads
+
+    def encode_ndjson(self, batches):
+        renderer = FastJSONRenderer()
+        for payloads in batches:
+            yield b''.join(
+                renderer.render(payload) + b'\n' for payload in payloads)
+
+    def encode_csv(self, batches):
+        """One column per field, authors and shelves as JSON."""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=[
+            *(name for name, _, _ in self.row_serializer.fields),
+            *self.row_serializer.related_fields,
+        ])
+        writer.writeheader()
+        for payloads in batches:
+            for payload in payloads:
+                writer.writerow({
+                    name: (json.dumps(value, cls=DjangoJSONEncoder)
+                           if isinstance(value, (list, dict)) else value)
+                    for name, value in payload.items()
+                })
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        # The header alone, for an empty catalog
+        yield buffer.getvalue().encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.flush()
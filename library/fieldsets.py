@@ -0,0 +1,93 @@
+"""
+Sparse fieldsets: ``?fields=`` and ``?exclude=`` on list and retrieve.
+
+Both take comma separated serializer field names. The selection narrows
+the serializer and is pushed down into SQL with only(), so unrequested
+columns such as descriptions are never read, and relations such as
+authors and shelves are not looked up at all.
+"""
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+
+def parse_field_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsSerializerMixin:
+    """Drops the fields missing from ``context['fields']`` when it is set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get('fields')
+        if requested is not None:
+            for name in list(self.fields):
+                if name not in requested:
+                    self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """
+    View mixin selecting fields from the query string. Serializer fields
+    not backed by a column of their own name list the columns they read
+    in ``field_columns``.
+    """
+    field_columns = {}
+    sparse_actions = ('list', 'retrieve')
+
+    def get_requested_fields(self):
+        """The set of field names to return, None for all of them."""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = self.parse_requested_fields()
+        return self._requested_fields
+
+    def parse_requested_fields(self):
+        params = self.request.query_params
+        if (self.action not in self.sparse_actions
+                or not (FIELDS_PARAM in params or EXCLUDE_PARAM in params)):
+            return None
+
+        available = list(self.get_serializer_class()().fields)
+        selected = {}
+        for param in (FIELDS_PARAM, EXCLUDE_PARAM):
+            names = parse_field_names(params.get(param, ''))
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                raise ValidationError({param: [
+                    f"Unknown field(s): {', '.join(unknown)}. Available "
+                    f"fields: {', '.join(available)}."
+                ]})
+            selected[param] = names
+
+        fields = set(selected[FIELDS_PARAM] or available)
+        return fields - set(selected[EXCLUDE_PARAM])
+
+    def get_requested_columns(self, fields):
+        model = self.queryset.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = [model._meta.pk.name]
+        columns += [name for name in fields if name in concrete]
+        for name in fields:
+            columns.extend(self.field_columns.get(name, ()))
+        return columns
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*self.get_requested_columns(fields))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.get_requested_fields()
+        return context
+
+    def get_row_serializer(self):
+        row_serializer = super().get_row_serializer()
+        fields = self.get_requested_fields()
+        if fields is None:
+            return row_serializer
+        return row_serializer.select(fields)
@@ -0,0 +1,52 @@
+import datetime
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class CatalogFilter(BaseFilterBackend):
+    """
+    Structured filters from the query string, declared on the view:
+
+    * ``exact_filters``: a dict of parameter -> lookup path, matched for
+      equality
+    * ``range_filters``: a dict of parameter -> (column, lookup, parse)
+
+    Ordering is left to CatalogPagination, which applies the same
+    ``?ordering=`` names in both of its modes.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        for param, path in getattr(view, 'exact_filters', {}).items():
+            value = params.get(param)
+            if value not in (None, ''):
+                queryset = queryset.filter(**{path: value})
+
+        for param, (column, lookup, parse) in getattr(
+                view, 'range_filters', {}).items():
+            value = params.get(param)
+            if value in (None, ''):
+                continue
+            try:
+                value = parse(value)
+            except ValueError:
+                raise ValidationError({param: [f'Invalid value {value!r}.']})
+            queryset = queryset.filter(**{f'{column}__{lookup}': value})
+        return queryset
+
+
+def date_range_filters(column, prefix):
+    """``<prefix>_after`` and ``<prefix>_before``, inclusive ISO dates."""
+    return {
+        f'{prefix}_after': (column, 'gte', datetime.date.fromisoformat),
+        f'{prefix}_before': (column, 'lte', datetime.date.fromisoformat),
+    }
+
+
+def min_max_filters(column, name, parse=int):
+    """``min_<name>`` and ``max_<name>``, inclusive."""
+    return {
+        f'min_{name}': (column, 'gte', parse),
+        f'max_{name}': (column, 'lte', parse),
+    }
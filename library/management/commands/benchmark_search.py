@@ -0,0 +1,68 @@
+import json
+import statistics
+import time
+from functools import reduce
+from operator import and_, or_
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from library.models import Book
+from library.search import is_supported, search
+
+PAGE_SIZE = 10
+
+
+def like_search(terms):
+    # What DRF's SearchFilter builds for search_fields = ['title', 'authors__name']
+    return Book.objects.filter(reduce(and_, [
+        reduce(or_, [Q(title__icontains=term), Q(authors__name__icontains=term)])
+        for term in terms
+    ])).distinct()
+
+
+def time_query(queryset, repeat):
+    """Median seconds to count the matches and fetch the first page."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        queryset.count()
+        list(queryset[:PAGE_SIZE])
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = ('Compare LIKE search with the full-text index on the loaded '
+            'catalog, load a large one first with import_books')
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*',
+                            default=['harry', 'love', 'tolkien', 'war peace'])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', type=str, default=None,
+                            help='Write the results to this JSON file')
+
+    def handle(self, *args, **kwargs):
+        if not is_supported():
+            raise CommandError('The database has no full-text index')
+
+        repeat = kwargs['repeat']
+        results = {'books': Book.objects.count(), 'repeat': repeat, 'terms': []}
+        self.stdout.write(f"{results['books']} books, median of {repeat} runs")
+
+        for phrase in kwargs['terms']:
+            terms = phrase.split()
+            like_seconds = time_query(like_search(terms), repeat)
+            fts_seconds = time_query(search(Book.objects.all(), terms), repeat)
+            results['terms'].append({
+                'term': phrase,
+                'like_ms': round(like_seconds * 1000, 3),
+                'fts_ms': round(fts_seconds * 1000, 3),
+            })
+            self.stdout.write(
+                f'{phrase!r}: like {like_seconds * 1000:.1f} ms, '
+                f'fts {fts_seconds * 1000:.1f} ms '
+                f'({like_seconds / fts_seconds:.1f}x)')
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w') as file:
+                json.dump(results, file, indent=2)
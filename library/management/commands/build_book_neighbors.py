@@ -0,0 +1,108 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from library.caching import bump_catalog_version
+from library.models import BookNeighbor, BookShelf
+
+
+def top_neighbors(scores, begin, book_ids, top_k):
+    """
+    Best ``top_k`` neighbors of each row of a block of similarities, the
+    block's first row being book number ``begin``.
+    """
+    import numpy as np
+
+    scores = scores.tocsr()
+    neighbors = []
+    for offset in range(scores.shape[0]):
+        row = begin + offset
+        start, end = scores.indptr[offset], scores.indptr[offset + 1]
+        columns = scores.indices[start:end]
+        values = scores.data[start:end]
+        keep = (columns != row) & (values > 0)
+        columns, values = columns[keep], values[keep]
+        if len(values) > top_k:
+            best = np.argpartition(-values, top_k)[:top_k]
+            columns, values = columns[best], values[best]
+        order = np.lexsort((columns, -values))
+        for rank, position in enumerate(order, start=1):
+            neighbors.append(BookNeighbor(
+                book_id=int(book_ids[row]),
+                neighbor_id=int(book_ids[columns[position]]),
+                score=float(values[position]),
+                rank=rank,
+            ))
+    return neighbors
+
+
+class Command(BaseCommand):
+    help = ('Precompute each book\'s most similar books from TF-IDF '
+            'weighted shelf counts, used by recommend_books')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=20,
+                            help='Number of neighbors kept per book')
+        parser.add_argument('--max-df', type=float, default=0.2,
+                            help='Ignore shelves found on more than this '
+                                 'fraction of books')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of books scored at once')
+
+    def handle(self, *args, **kwargs):
+        try:
+            import numpy as np
+            from scipy import sparse
+        except ImportError:
+            raise CommandError(
+                'build_book_neighbors needs numpy and scipy installed')
+
+        top_k = kwargs['top_k']
+        batch_size = kwargs['batch_size']
+        started = time.monotonic()
+
+        rows = BookShelf.objects.values_list(
+            'book_id', 'shelf_id', 'count').iterator(chunk_size=10000)
+        triples = np.fromiter(
+            (value for row in rows for value in row), dtype=np.int64)
+        triples = triples.reshape(-1, 3)
+        if not len(triples):
+            raise CommandError('There are no shelf counts to build from')
+        book_ids, book_index = np.unique(triples[:, 0], return_inverse=True)
+        _, shelf_index = np.unique(triples[:, 1], return_inverse=True)
+        counts = np.maximum(triples[:, 2], 0).astype(np.float64)
+        self.stdout.write(
+            f'{len(triples)} shelf counts over {len(book_ids)} books')
+
+        matrix = sparse.csr_matrix(
+            (np.log1p(counts), (book_index, shelf_index)))
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+
+        # Shelves on nearly every book ("to-read") say nothing about
+        # similarity and would make every row of the product dense
+        document_frequency = np.bincount(
+            matrix.indices, minlength=matrix.shape[1])
+        idf = np.log(len(book_ids) / np.maximum(document_frequency, 1))
+        idf[document_frequency > kwargs['max_df'] * len(book_ids)] = 0
+        matrix = matrix @ sparse.diags(idf)
+        matrix.eliminate_zeros()
+
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms) @ matrix
+        transposed = matrix.T.tocsr()
+
+        stored = 0
+        with transaction.atomic():
+            BookNeighbor.objects.all().delete()
+            for begin in range(0, len(book_ids), batch_size):
+                neighbors = top_neighbors(
+                    matrix[begin:begin + batch_size] @ transposed,
+                    begin, book_ids, top_k)
+                BookNeighbor.objects.bulk_create(neighbors, batch_size=5000)
+                stored += len(neighbors)
+        bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully stored {stored} neighbors in '
+            f'{time.monotonic() - started:.1f}s'))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from library.export import EXPORT_BATCH_SIZE, EXPORT_CONTENT_TYPES, CatalogExport
+
+
+class Command(BaseCommand):
+    help = 'Export the book catalog as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str)
+        parser.add_argument('--format', choices=list(EXPORT_CONTENT_TYPES),
+                            default='ndjson')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Compress the output with gzip')
+        parser.add_argument('--batch-size', type=int,
+                            default=EXPORT_BATCH_SIZE,
+                            help='Number of books read and serialized at a '
+                                 'time')
+
+    def handle(self, *args, **kwargs):
+        export = CatalogExport(
+            kwargs['format'], compress=kwargs.get('gzip', False),
+            batch_size=kwargs.get('batch_size', EXPORT_BATCH_SIZE))
+        started = time.monotonic()
+        with open(kwargs['output'], 'wb') as file:
+            for chunk in export:
+                file.write(chunk)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully exported {export.exported} books '
+            f'({export.exported / elapsed if elapsed else 0:.0f} rows/sec)'))
@@ -0,0 +1,131 @@
+import json
+import random
+from itertools import accumulate
+from django.core.management.base import BaseCommand
+
+WORDS = (
+    'night shadow house king queen dragon river secret last love war peace '
+    'city garden winter summer fire stone glass road lost child dark light '
+    'heart blood star sea island mountain forest ghost dream time song storm '
+    'crown empire girl boy wolf bird silver golden iron broken hidden wild'
+).split()
+LANGUAGES = ['eng', 'eng', 'eng', 'eng', 'eng', 'eng', 'en-US', 'spa', 'fre',
+             'ger', 'ita', 'por', 'jpn']
+FORMATS = ['Paperback', 'Hardcover', 'Kindle Edition', 'Mass Market Paperback',
+           'ebook', 'Audiobook', '']
+ROLES = ['', '', '', '', 'Illustrator', 'Translator', 'Editor']
+COMMON_SHELVES = ['to-read', 'currently-reading', 'favorites', 'owned',
+                  'books-i-own', 'fiction', 'kindle', 'library', 'ebook']
+
+
+def zipf_weights(size, exponent):
+    """Cumulative weights of a Zipf distribution over ``size`` ranks."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = ('Generate a synthetic Goodreads-shaped books NDJSON file, with '
+            'skewed author, series, shelf and language distributions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--authors', type=int, default=None,
+                            help='Defaults to a fifth of the books')
+        parser.add_argument('--shelves', type=int, default=5000,
+                            help='Number of distinct shelf names')
+        parser.add_argument('--shelves-per-book', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **kwargs):
+        books = kwargs['books']
+        generator = random.Random(kwargs['seed'])
+        authors = kwargs['authors'] or max(books // 5, 1)
+        shelves_per_book = kwargs['shelves_per_book']
+
+        author_weights = zipf_weights(authors, 1.1)
+        shelf_names = COMMON_SHELVES + [
+            f'{generator.choice(WORDS)}-{index}'
+            for index in range(kwargs['shelves'])]
+        shelf_weights = zipf_weights(len(shelf_names), 1.0)
+        author_ids = range(1, authors + 1)
+        series_count = max(books // 8, 1)
+
+        with open(kwargs['output'], 'w') as file:
+            for book_id in range(1, books + 1):
+                record = self.make_book(
+                    generator, book_id, author_ids, author_weights,
+                    series_count, shelf_names, shelf_weights,
+                    shelves_per_book)
+                file.write(json.dumps(record) + '\n')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully wrote {books} books to {kwargs['output']}"))
+
+    def make_book(self, generator, book_id, author_ids, author_weights,
+                  series_count, shelf_names, shelf_weights, shelves_per_book):
+        book_authors = list(dict.fromkeys(generator.choices(
+            author_ids, cum_weights=author_weights,
+            k=generator.choice([1, 1, 1, 1, 2, 3]))))
+        # Popularity follows a heavy tail: most books have few ratings
+        ratings_count = int(generator.paretovariate(1.2) * 20) - 20
+        stars = [generator.random() ** exponent for exponent in (0.5, 1, 2, 3, 4)]
+        total_stars = sum(stars)
+        rating_dist = [round(ratings_count * star / total_stars)
+                       for star in stars]
+        # Rounding moves the total, the count and average follow the buckets
+        ratings_count = sum(rating_dist)
+        average_rating = (
+            sum(count * (5 - index) for index, count in enumerate(rating_dist))
+            / ratings_count if ratings_count else 0)
+        year = generator.randint(1850, 2020)
+        in_series = generator.random() < 0.3
+        series_id = generator.randrange(1, series_count + 1)
+        title = ' '.join(generator.choices(WORDS, k=generator.randint(1, 5)))
+
+        shelves = {}
+        for name in generator.choices(shelf_names, cum_weights=shelf_weights,
+                                      k=shelves_per_book):
+            shelves.setdefault(name, 0)
+        shelf_count = max(ratings_count, 1)
+        for name in shelves:
+            shelves[name] = max(int(shelf_count * generator.random() ** 3), 1)
+
+        return {
+            'id': str(book_id),
+            'title': title.title(),
+            'authors': [
+                {'id': str(author_id), 'name': f'Author {author_id}',
+                 'role': '' if index == 0 else generator.choice(ROLES)}
+                for index, author_id in enumerate(book_authors)
+            ],
+            'author_name': f'Author {book_authors[0]}',
+            'author_id': str(book_authors[0]),
+            'work_id': str(book_id * 7),
+            'isbn': f'{generator.randrange(10 ** 9):09d}X',
+            'isbn13': f'978{generator.randrange(10 ** 10):010d}',
+            'language': generator.choice(LANGUAGES),
+            'average_rating': f'{average_rating:.2f}',
+            'rating_dist': '|'.join(
+                [f'{5 - index}:{count}' for index, count in enumerate(rating_dist)]
+                + [f'total:{ratings_count}']),
+            'ratings_count': str(ratings_count),
+            'text_reviews_count': str(ratings_count // 20),
+            'publication_date': f'{year + generator.randint(0, 5)}-'
+                                f'{generator.randint(1, 12):02d}-'
+                                f'{generator.randint(1, 28):02d}',
+            'original_publication_date': generator.choice(
+                [f'{year}-01-01', str(year), '']),
+            'format': generator.choice(FORMATS),
+            'edition_information': generator.choice(['', '', 'First Edition']),
+            'image_url': f'https://images.example.com/books/{book_id}.jpg',
+            'publisher': f'Publisher {generator.randrange(500)}',
+            'num_pages': str(generator.randint(40, 1200)),
+            'series_id': str(series_id) if in_series else '',
+            'series_name': f'Series {series_id}' if in_series else '',
+            'series_position': str(generator.randint(1, 8)) if in_series else '',
+            'description': ' '.join(
+                generator.choices(WORDS, k=generator.randint(20, 120))),
+            'shelves': [{'name': name, 'count': count}
+                        for name, count in shelves.items()],
+        }
@@ -0,0 +1,149 @@
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library.caching import bump_catalog_version
+from library.management.commands.import_books import (
+    LOOKUP_BATCH_SIZE, batched, parse_int, sequential_chunks)
+from library.models import Author, Book
+from library.search import index_books
+from library.sqlite import bulk_load
+
+# Author columns refreshed from the authors dataset. role comes from the
+# books dataset and is left alone
+AUTHOR_UPDATE_FIELDS = [
+    'name', 'gender', 'image_url', 'about', 'ratings_count',
+    'average_rating', 'text_reviews_count', 'fans_count', 'works_count',
+    'work_ids', 'book_ids',
+]
+
+
+def parse_rating(value):
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except (InvalidOperation, TypeError, ValueError):
+        return Decimal(0)
+
+
+def normalize_author(item):
+    """Map a raw authors dataset line onto Author columns."""
+    return {
+        'api_id': str(item.get('id', '')),
+        'name': item.get('name', ''),
+        'gender': item.get('gender', ''),
+        'image_url': item.get('image_url', ''),
+        'about': item.get('about', ''),
+        'ratings_count': parse_int(item.get('ratings_count', 0)),
+        'average_rating': parse_rating(item.get('average_rating', 0)),
+        'text_reviews_count': parse_int(item.get('text_reviews_count', 0)),
+        'fans_count': parse_int(item.get('fans_count', 0)),
+        'works_count': parse_int(item.get('works_count', 0)),
+        'work_ids': [str(work_id) for work_id in item.get('work_ids', [])],
+        'book_ids': [str(book_id) for book_id in item.get('book_ids', [])],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Import author data from a JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('json_file', type=str)
+        parser.add_argument('--limit', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of lines written per transaction')
+
+    def handle(self, *args, **kwargs):
+        json_file = kwargs['json_file']
+        limit = kwargs.get('limit', None)
+        chunk_size = kwargs.get('chunk_size', 1000)
+        if limit:
+            chunk_size = min(chunk_size, limit)
+
+        self.started = time.monotonic()
+        self.imported = 0
+        self.linked = 0
+        # Nothing is kept across chunks, memory use only depends on the
+        # chunk size
+        chunks = sequential_chunks(
+            json_file, chunk_size, limit=limit, normalize=normalize_author)
+        try:
+            with bulk_load():
+                for chunk, _ in chunks:
+                    self.write_chunk(chunk)
+        finally:
+            chunks.close()
+            # Book payloads embed their authors
+            if self.imported:
+                bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported author data: {self.imported} rows, '
+            f'{self.linked} links to catalog books '
+            f'({self.throughput():.0f} rows/sec)'))
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.imported / elapsed if elapsed else 0.0
+
+    def count_links(self, author_ids):
+        return sum(
+            Book.authors.through.objects.filter(author_id__in=batch).count()
+            for batch in batched(author_ids, LOOKUP_BATCH_SIZE))
+
+    def write_chunk(self, records):
+        # A repeated id within the chunk keeps its last occurrence
+        by_api_id = {record['api_id']: record for record in records
+                     if record['api_id']}
+
+        with transaction.atomic():
+            Author.objects.bulk_create(
+                [Author(**record) for record in by_api_id.values()],
+                update_conflicts=True,
+                unique_fields=['api_id'],
+                update_fields=AUTHOR_UPDATE_FIELDS,
+            )
+            author_ids = {}
+            for batch in batched(by_api_id, LOOKUP_BATCH_SIZE):
+                author_ids.update(
+                    Author.objects.filter(api_id__in=batch)
+                    .values_list('api_id', 'id'))
+
+            book_api_ids = {book_api_id for record in by_api_id.values()
+                            for book_api_id in record['book_ids']}
+            book_ids = {}
+            for batch in batched(book_api_ids, LOOKUP_BATCH_SIZE):
+                book_ids.update(
+                    Book.objects.filter(dataset_api_id__in=batch)
+                    .values_list('dataset_api_id', 'id'))
+
+            # Links are only added: a book's own author list in the books
+            # dataset is a source of them too. Books outside the catalog
+            # are skipped
+            BookAuthor = Book.authors.through
+            existing_links = self.count_links(author_ids.values())
+            BookAuthor.objects.bulk_create(
+                [BookAuthor(book_id=book_ids[book_api_id],
+                            author_id=author_ids[api_id])
+                 for api_id, record in by_api_id.items()
+                 for book_api_id in record['book_ids']
+                 if book_api_id in book_ids],
+                ignore_conflicts=True,
+            )
+
+            # bulk_create() returns the conflicting links it ignored too
+            linked = self.count_links(author_ids.values()) - existing_links
+
+            # Search documents hold author names, refresh those of every
+            # book linked to the chunk's authors
+            indexed = set()
+            for batch in batched(author_ids.values(), LOOKUP_BATCH_SIZE):
+                indexed.update(
+                    BookAuthor.objects.filter(author_id__in=batch)
+                    .values_list('book_id', flat=True))
+            index_books(sorted(indexed))
+
+        self.imported += len(records)
+        self.linked += linked
+        self.stdout.write(
+            f'{self.imported} rows imported ({self.throughput():.0f} rows/sec)')
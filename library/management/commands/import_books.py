@@ -1,7 +1,98 @@
-from typing import List
+import io
 import json
-from django.core.management.base import BaseCommand
-from library.models import Book, Shelf, BookShelf, Author
+import multiprocessing
+import os
+import queue as queues
+import time
+import traceback
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from library.caching import bump_catalog_version
+from library.models import Book, Shelf, BookShelf, Author, TOP_SHELVES_LIMIT
+from library.normalize import TYPED_BOOK_COLUMNS, typed_book_columns
+from library.search import index_books
+from library.sqlite import bulk_load
+
+
+# Book columns refreshed when a record is imported again. top_shelves is
+# left out since shelves are only written for new books
+BOOK_UPDATE_FIELDS = [
+    'title', 'author_name', 'author_id', 'work_id', 'isbn', 'isbn13',
+    'language', 'average_rating', 'rating_dist', 'ratings_count',
+    'text_reviews_count', 'publication_date', 'original_publication_date',
+    'format', 'edition_information', 'image_url', 'publisher', 'num_pages',
+    'series_id', 'series_name', 'series_position', 'description',
+    *TYPED_BOOK_COLUMNS,
+]
+
+
+# Every Book column written by the importer, in COPY order
+BOOK_COLUMNS = ['dataset_api_id', *BOOK_UPDATE_FIELDS, 'top_shelves']
+
+# Author columns filled from the dataset, the others get their defaults
+AUTHOR_COLUMNS = ['api_id', 'name', 'role']
+
+# Staging tables of the --copy path. They are temporary, so private to
+# the connection, and emptied before each chunk
+STAGING_TABLES = {
+    'import_author': 'api_id text, name text, role text',
+    'import_book_author': 'dataset_api_id text, author_api_id text',
+    'import_book_shelf': 'dataset_api_id text, shelf_name text, count integer',
+}
+
+MERGE_SHELVES_SQL = """
+INSERT INTO library_shelf (name)
+SELECT DISTINCT shelf_name FROM import_book_shelf
+ON CONFLICT (name) DO NOTHING
+"""
+
+# Upserts the chunk's books and links authors and shelves to the books it
+# created, existing books only get their columns refreshed. xmax is 0 for
+# rows inserted rather than updated by the statement
+MERGE_BOOKS_SQL = """
+WITH upserted AS (
+    INSERT INTO library_book ({columns})
+    SELECT {columns} FROM import_book
+    ON CONFLICT (dataset_api_id) DO UPDATE SET {updates}
+    RETURNING id, dataset_api_id, xmax = 0 AS inserted
+),
+new_book AS (
+    SELECT id, dataset_api_id FROM upserted WHERE inserted
+),
+book_author AS (
+    INSERT INTO library_book_authors (book_id, author_id)
+    SELECT new_book.id, author.id
+    FROM new_book
+    JOIN import_book_author link
+        ON link.dataset_api_id = new_book.dataset_api_id
+    JOIN library_author author ON author.api_id = link.author_api_id
+    ON CONFLICT DO NOTHING
+),
+book_shelf AS (
+    INSERT INTO library_bookshelf (book_id, shelf_id, count)
+    SELECT new_book.id, shelf.id, link.count
+    FROM new_book
+    JOIN import_book_shelf link
+        ON link.dataset_api_id = new_book.dataset_api_id
+    JOIN library_shelf shelf ON shelf.name = link.shelf_name
+)
+SELECT id FROM upserted
+""".format(
+    columns=', '.join(BOOK_COLUMNS),
+    updates=', '.join(
+        f'{column} = EXCLUDED.{column}' for column in BOOK_UPDATE_FIELDS),
+)
+
+
+# Keeps ``__in`` lookups under the SQLite bound parameter limit
+LOOKUP_BATCH_SIZE = 900
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
 
 
 def parse_int(value):
@@ -18,6 +109,231 @@ def parse_float(value):
         return 0.0
 
 
+def normalize_record(item):
+    """
+    Map a raw dataset line onto plain values ready to be written:
+    the Book columns, the (api_id, name, role) author tuples and the
+    (name, count) shelf tuples.
+    """
+    shelves = [
+        (shelf.get('name'), parse_int(shelf.get('count', 0)))
+        for shelf in item.get('shelves', [])
+    ]
+    book = {
+        'dataset_api_id': item.get('id', ''),
+        'title': item.get('title', ''),
+        'author_name': item.get('author_name', ''),
+        'author_id': item.get('author_id', ''),
+        'work_id': item.get('work_id', ''),
+        'isbn': item.get('isbn', ''),
+        'isbn13': item.get('isbn13', ''),
+        'language': item.get('language', ''),
+        'average_rating': parse_float(item.get('average_rating', 0.0)),
+        'rating_dist': item.get('rating_dist', ''),
+        'ratings_count': parse_int(item.get('ratings_count', 0)),
+        'text_reviews_count': parse_int(item.get('text_reviews_count', 0)),
+        'publication_date': item.get('publication_date', ''),
+        'original_publication_date': item.get('original_publication_date', ''),
+        'format': item.get('format', ''),
+        'edition_information': item.get('edition_information', ''),
+        'image_url': item.get('image_url', ''),
+        'publisher': item.get('publisher', ''),
+        'num_pages': parse_int(item.get('num_pages', 0)),
+        'series_id': item.get('series_id', ''),
+        'series_name': item.get('series_name', ''),
+        'series_position': item.get('series_position', ''),
+        'description': item.get('description', ''),
+        'top_shelves': [
+            [name, count] for name, count in sorted(
+                shelves, key=lambda shelf: shelf[1], reverse=True
+            )[:TOP_SHELVES_LIMIT]
+        ],
+    }
+    book.update(typed_book_columns(
+        book['publication_date'], book['original_publication_date'],
+        book['rating_dist'], book['isbn'], book['isbn13']))
+    authors = [
+        (str(author['id']), author.get('name', ''), author.get('role', ''))
+        for author in item.get('authors', [])
+        if author.get('id') is not None
+    ]
+    return {'book': book, 'authors': authors, 'shelves': shelves}
+
+
+def copy_value(value):
+    """A value in PostgreSQL's COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream ``rows`` into ``table`` with COPY FROM STDIN."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    data = ''.join(
+        '\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+    if hasattr(cursor, 'copy'):
+        # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(data)
+    else:
+        cursor.copy_expert(sql, io.StringIO(data))
+
+
+def sequential_chunks(json_file, chunk_size, start=1, limit=None,
+                      offset=0, line_number=0, normalize=normalize_record):
+    """
+    Yield ``(chunk, (offset, line_number))`` pairs, the position being the
+    byte offset and line number just past the chunk's last line. Lines
+    are parsed with ``normalize``.
+    """
+    with open(json_file, 'rb') as file:
+        file.seek(offset)
+        chunk = []
+        line_count = 0
+        for line in file:
+            if limit and line_count >= limit:
+                break
+
+            offset += len(line)
+            line_number += 1
+
+            # Skip lines before the start line
+            if line_number < start or not line.strip():
+                continue
+
+            line_count += 1
+            chunk.append(normalize(json.loads(line)))
+            if len(chunk) >= chunk_size:
+                yield chunk, (offset, line_number)
+                chunk = []
+
+        if chunk:
+            yield chunk, (offset, line_number)
+
+
+def read_checkpoint(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    # Write then rename so a crash never leaves a truncated checkpoint
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(temporary_path, path)
+
+
+def shard_ranges(json_file, shards):
+    """
+    Split the file into ``shards`` byte ranges whose boundaries fall on
+    line starts.
+    """
+    size = os.path.getsize(json_file)
+    offsets = [0]
+    with open(json_file, 'rb') as file:
+        for shard in range(1, shards):
+            file.seek(max(size * shard // shards, offsets[-1]))
+            # Move past the line the boundary landed in
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(begin, end) for begin, end in zip(offsets, offsets[1:])
+            if begin < end]
+
+
+# Seconds the writer waits on the parsing workers before checking that
+# they are still running
+WORKER_POLL_SECONDS = 5
+
+
+def parse_shard(json_file, begin, end, chunk_size, queue):
+    """
+    Worker process: normalize the lines starting inside [begin, end) and
+    send them to the writer in chunks, followed by a ``None`` sentinel.
+    Failures are sent back as a formatted traceback string.
+    """
+    try:
+        with open(json_file, 'rb') as file:
+            file.seek(begin)
+            position = begin
+            chunk = []
+            while position < end:
+                line = file.readline()
+                if not line:
+                    break
+                position += len(line)
+                if not line.strip():
+                    continue
+
+                chunk.append(normalize_record(json.loads(line)))
+                if len(chunk) >= chunk_size:
+                    queue.put(chunk)
+                    chunk = []
+
+            if chunk:
+                queue.put(chunk)
+    except Exception:
+        queue.put(traceback.format_exc())
+    queue.put(None)
+
+
+def parallel_chunks(json_file, workers, chunk_size):
+    """
+    Parse the file in ``workers`` processes and yield their normalized
+    chunks. Only the calling process touches the database. Chunks arrive
+    out of file order, so no resumable position is yielded with them.
+    A worker that dies without sending its sentinel, killed by a signal
+    for instance, aborts the import instead of leaving it waiting.
+    """
+    queue = multiprocessing.Queue(maxsize=workers * 2)
+    processes = [
+        multiprocessing.Process(
+            target=parse_shard,
+            args=(json_file, begin, end, chunk_size, queue),
+            daemon=True)
+        for begin, end in shard_ranges(json_file, workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        running = len(processes)
+        while running:
+            try:
+                chunk = queue.get(timeout=WORKER_POLL_SECONDS)
+            except queues.Empty:
+                exitcodes = [process.exitcode for process in processes]
+                if None in exitcodes and not any(exitcodes):
+                    continue
+                # Workers flush the queue before exiting, but what they sent
+                # may only have arrived since the timeout. Once it is read,
+                # nothing more is coming
+                try:
+                    chunk = queue.get_nowait()
+                except queues.Empty:
+                    raise CommandError(
+                        f'Parsing worker exited early, exit codes {exitcodes}')
+            if chunk is None:
+                running -= 1
+            elif isinstance(chunk, str):
+                raise CommandError(f'Parsing worker failed:\n{chunk}')
+            else:
+                yield chunk, None
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
 class Command(BaseCommand):
     help = 'Import book data from a JSON file'
 
@@ -26,99 +342,267 @@ class Command(BaseCommand):
         parser.add_argument('--limit', type=int, default=None)
         parser.add_argument('--start', type=int, default=1,
                             help='Line number to start processing')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of lines written per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes parsing the file')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue from the last committed chunk')
+        parser.add_argument('--checkpoint', type=str, default=None,
+                            help='Checkpoint file, defaults to '
+                                 '<json_file>.checkpoint')
+        parser.add_argument('--copy', action='store_true',
+                            help='Load chunks through COPY into staging '
+                                 'tables (PostgreSQL only)')
 
     def handle(self, *args, **kwargs):
         json_file = kwargs['json_file']
         limit = kwargs.get('limit', None)
         start = kwargs.get('start', 1)
+        chunk_size = kwargs.get('chunk_size', 1000)
+        workers = kwargs.get('workers', 1)
+        resume = kwargs.get('resume', False)
+        checkpoint_path = kwargs.get('checkpoint') or f'{json_file}.checkpoint'
+        # A checkpoint only applies to the file it was written for
+        stat = os.stat(json_file)
+        source = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if limit:
+            chunk_size = min(chunk_size, limit)
+        write_chunk = self.write_chunk
+        if kwargs.get('copy'):
+            if connection.vendor != 'postgresql':
+                raise CommandError('--copy needs a PostgreSQL database')
+            write_chunk = self.copy_chunk
 
-        with open(json_file, 'r') as file:
-            line_count = 1
-            for line_number, line in enumerate(file, start=1):
+        # api_id -> pk and shelf name -> pk, shared across chunks
+        self.author_ids = {}
+        self.shelf_ids = {}
+        self.started = time.monotonic()
+        self.imported = 0
+        chunk_number = 0
 
-                # Skip lines before the start line
-                if line_number < start:
-                    continue
+        if workers > 1:
+            # Workers parse their shards concurrently, the first --limit
+            # lines to arrive would be an arbitrary subset of the file
+            if start != 1 or resume or limit:
+                raise CommandError(
+                    '--start, --resume and --limit cannot be used with '
+                    '--workers')
+            chunks = parallel_chunks(json_file, workers, chunk_size)
+        elif resume:
+            if start != 1:
+                raise CommandError('--start cannot be used with --resume')
+            checkpoint = read_checkpoint(checkpoint_path) or {
+                'offset': 0, 'line': 0, 'chunk': 0, **source}
+            if any(checkpoint.get(key) != value
+                   for key, value in source.items()):
+                raise CommandError(
+                    f'Checkpoint {checkpoint_path} was written for another '
+                    f'version of {json_file}, delete it to import from the '
+                    f'start')
+            chunk_number = checkpoint['chunk']
+            self.stdout.write(
+                f"Resuming after line {checkpoint['line']} "
+                f"(byte {checkpoint['offset']}, chunk {chunk_number})")
+            chunks = sequential_chunks(
+                json_file, chunk_size, limit=limit,
+                offset=checkpoint['offset'], line_number=checkpoint['line'])
+        else:
+            chunks = sequential_chunks(
+                json_file, chunk_size, start=start, limit=limit)
 
-                if limit:
-                    if line_count > limit:
+        checkpointing = True
+        try:
+            with bulk_load():
+                for chunk, position in chunks:
+                    if limit:
+                        chunk = chunk[:limit - self.imported]
+                    write_chunk(chunk)
+                    chunk_number += 1
+
+                    # Only record a position once its chunk has been committed
+                    if position is not None and checkpointing:
+                        offset, line_number = position
+                        try:
+                            write_checkpoint(checkpoint_path, {
+                                'offset': offset,
+                                'line': line_number,
+                                'chunk': chunk_number,
+                                **source,
+                            })
+                        except OSError as error:
+                            # A read-only dataset directory, say. The import
+                            # goes on, it just can't be resumed
+                            checkpointing = False
+                            self.stderr.write(
+                                f'Not writing checkpoints, --resume will not '
+                                f'be possible: {error}')
+
+                    if limit and self.imported >= limit:
                         break
+        finally:
+            chunks.close()
+            # Cached recommendations were built from the previous catalog
+            if self.imported:
+                bump_catalog_version()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported book data: {self.imported} rows '
+            f'({self.throughput():.0f} rows/sec)'))
 
-                line_count += 1
-                bookshelf_instances = []
-                item = json.loads(line)
-
-                dataset_api_id = item.get('id', '')
-                authors = item.get('authors', [])
-                author_instances: List[Author] = []
-
-                print(item)
-                for author_data in authors:
-                    api_id = author_data.get('id')
-                    author, created = Author.objects.get_or_create(
-                        api_id=api_id,
-                        defaults={
-                            'name': author_data.get('name', ''),
-                            'role': author_data.get('role', '')
-                        }
-                    )
-
-                    author_instances.append(author)
-
-                # Create or update book instance
-                book, created = Book.objects.update_or_create(
-                    dataset_api_id=dataset_api_id,
-                    defaults={
-                        'title': item.get('title', ''),
-                        'author_name': item.get('author_name', ''),
-                        'author_id': item.get('author_id', ''),
-                        'work_id': item.get('work_id', ''),
-                        'isbn': item.get('isbn', ''),
-                        'isbn13': item.get('isbn13', ''),
-                        'language': item.get('language', ''),
-                        'average_rating': parse_float(item.get('average_rating', 0.0)),
-                        'rating_dist': item.get('rating_dist', ''),
-                        'ratings_count': parse_int(item.get('ratings_count', 0)),
-                        'text_reviews_count': parse_int(item.get('text_reviews_count', 0)),
-                        'publication_date': item.get('publication_date', ''),
-                        'original_publication_date': item.get('original_publication_date', ''),
-                        'format': item.get('format', ''),
-                        'edition_information': item.get('edition_information', ''),
-                        'image_url': item.get('image_url', ''),
-                        'publisher': item.get('publisher', ''),
-                        'num_pages': parse_int(item.get('num_pages', 0)),
-                        'series_id': item.get('series_id', ''),
-                        'series_name': item.get('series_name', ''),
-                        'series_position': item.get('series_position', ''),
-                        'description': item.get('description', '')
-                    }
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return self.imported / elapsed if elapsed else 0.0
+
+    def write_chunk(self, records):
+        with transaction.atomic():
+            self.resolve_authors(records)
+            self.resolve_shelves(records)
+
+            # A repeated id within the chunk keeps its last occurrence
+            by_api_id = {record['book']['dataset_api_id']: record
+                         for record in records}
+            api_ids = list(by_api_id)
+
+            existing = set()
+            for batch in batched(api_ids, LOOKUP_BATCH_SIZE):
+                existing.update(
+                    Book.objects.filter(dataset_api_id__in=batch)
+                    .values_list('dataset_api_id', flat=True)
+                )
+            Book.objects.bulk_create(
+                [Book(**record['book']) for record in by_api_id.values()],
+                update_conflicts=True,
+                unique_fields=['dataset_api_id'],
+                update_fields=BOOK_UPDATE_FIELDS,
+            )
+            book_ids = {}
+            for batch in batched(api_ids, LOOKUP_BATCH_SIZE):
+                book_ids.update(
+                    Book.objects.filter(dataset_api_id__in=batch)
+                    .values_list('dataset_api_id', 'id')
                 )
-                if not created:
-                    # If the book already exists, skip the rest of the loop
+
+            # Authors and shelves are only attached to newly created books,
+            # existing books just get their columns refreshed
+            BookAuthor = Book.authors.through
+            book_authors = []
+            bookshelf_instances = []
+            for api_id, record in by_api_id.items():
+                if api_id in existing:
                     continue
+                book_id = book_ids[api_id]
+                for author_api_id, _, _ in record['authors']:
+                    book_authors.append(BookAuthor(
+                        book_id=book_id,
+                        author_id=self.author_ids[author_api_id]))
+                for shelf_name, shelf_count in record['shelves']:
+                    bookshelf_instances.append(BookShelf(
+                        book_id=book_id,
+                        shelf_id=self.shelf_ids[shelf_name],
+                        count=shelf_count))
 
-                book.authors.set(author_instances)
+            BookAuthor.objects.bulk_create(book_authors, ignore_conflicts=True)
+            BookShelf.objects.bulk_create(bookshelf_instances)
+            index_books(book_ids.values())
 
-                shelves = item.get('shelves', [])
-                for shelf_data in shelves:
-                    shelf_name = shelf_data.get('name')
-                    shelf_count = shelf_data.get('count', 0)
+        self.imported += len(records)
+        self.stdout.write(
+            f'{self.imported} rows imported ({self.throughput():.0f} rows/sec)')
 
-                    shelf, _ = Shelf.objects.get_or_create(
-                        name=shelf_name)
+    def copy_chunk(self, records):
+        # A repeated book keeps its last occurrence and a repeated author
+        # its first, as in write_chunk
+        by_api_id = {record['book']['dataset_api_id']: record
+                     for record in records}
+        authors = {}
+        for record in records:
+            for api_id, name, role in record['authors']:
+                authors.setdefault(api_id, (api_id, name, role))
+        author_defaults = [
+            (field.column, field.get_default())
+            for field in Author._meta.concrete_fields
+            if not field.primary_key and field.name not in AUTHOR_COLUMNS
+        ]
 
-                    bookshelf_instances.append(
-                        BookShelf(
-                            book=book,
-                            shelf=shelf,
-                            count=shelf_count
-                        )
-                    )
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.create_staging_tables(cursor)
+            copy_rows(cursor, 'import_book', BOOK_COLUMNS, (
+                [record['book'][column] for column in BOOK_COLUMNS]
+                for record in by_api_id.values()))
+            copy_rows(cursor, 'import_author', AUTHOR_COLUMNS,
+                      authors.values())
+            copy_rows(cursor, 'import_book_author',
+                      ['dataset_api_id', 'author_api_id'], (
+                          (book_api_id, author[0])
+                          for book_api_id, record in by_api_id.items()
+                          for author in record['authors']))
+            copy_rows(cursor, 'import_book_shelf',
+                      ['dataset_api_id', 'shelf_name', 'count'], (
+                          (book_api_id, name, count)
+                          for book_api_id, record in by_api_id.items()
+                          for name, count in record['shelves']))
 
-                # Bulk create BookShelf instances
-                if bookshelf_instances:
-                    BookShelf.objects.bulk_create(
-                        bookshelf_instances)
+            # Existing authors are left untouched, like write_chunk does
+            default_columns = [column for column, _ in author_defaults]
+            cursor.execute(
+                'INSERT INTO library_author ({}) SELECT {}, {} '
+                'FROM import_author ON CONFLICT (api_id) DO NOTHING'.format(
+                    ', '.join(AUTHOR_COLUMNS + default_columns),
+                    ', '.join(AUTHOR_COLUMNS),
+                    ', '.join(['%s'] * len(default_columns))),
+                [default for _, default in author_defaults])
+            cursor.execute(MERGE_SHELVES_SQL)
+            cursor.execute(MERGE_BOOKS_SQL)
+            book_ids = [row[0] for row in cursor.fetchall()]
+            index_books(book_ids)
 
-        self.stdout.write(self.style.SUCCESS(
-            'Successfully imported book data'))
+        self.imported += len(records)
+        self.stdout.write(
+            f'{self.imported} rows imported ({self.throughput():.0f} rows/sec)')
+
+    def create_staging_tables(self, cursor):
+        book_columns = ', '.join(
+            '{} {}'.format(field.column, field.db_type(connection))
+            for field in map(Book._meta.get_field, BOOK_COLUMNS))
+        tables = {'import_book': book_columns, **STAGING_TABLES}
+        for table, columns in tables.items():
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {table} ({columns})')
+        cursor.execute(f"TRUNCATE {', '.join(tables)}")
+
+    def resolve_authors(self, records):
+        missing = {}
+        for record in records:
+            for api_id, name, role in record['authors']:
+                if api_id not in self.author_ids:
+                    missing.setdefault(
+                        api_id, Author(api_id=api_id, name=name, role=role))
+        if not missing:
+            return
+
+        # Existing authors are left untouched, like get_or_create did
+        Author.objects.bulk_create(missing.values(), ignore_conflicts=True)
+        for batch in batched(missing, LOOKUP_BATCH_SIZE):
+            self.author_ids.update(
+                Author.objects.filter(api_id__in=batch)
+                .values_list('api_id', 'id')
+            )
+
+    def resolve_shelves(self, records):
+        missing = {
+            shelf_name
+            for record in records
+            for shelf_name, _ in record['shelves']
+            if shelf_name not in self.shelf_ids
+        }
+        if not missing:
+            return
+
+        Shelf.objects.bulk_create(
+            [Shelf(name=name) for name in missing], ignore_conflicts=True)
+        for batch in batched(missing, LOOKUP_BATCH_SIZE):
+            self.shelf_ids.update(
+                Shelf.objects.filter(name__in=batch)
+                .values_list('name', 'id')
+            )
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library.caching import bump_catalog_version
+from library.models import Book
+from library.utils import ranked_top_shelves
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized Book.top_shelves column from BookShelf'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of books updated per transaction')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Only fill books without top_shelves')
+
+    def handle(self, *args, **kwargs):
+        batch_size = kwargs.get('batch_size', 1000)
+        books = Book.objects.order_by('id')
+        if kwargs.get('missing_only'):
+            books = books.filter(top_shelves__isnull=True)
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Walk the table by primary key so each batch is an index range
+            book_ids = list(
+                books.filter(id__gt=last_id)
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not book_ids:
+                break
+            last_id = book_ids[-1]
+
+            top_shelves = ranked_top_shelves(book_ids)
+
+            with transaction.atomic():
+                Book.objects.bulk_update(
+                    [Book(id=book_id, top_shelves=shelves)
+                     for book_id, shelves in top_shelves.items()],
+                    ['top_shelves'],
+                )
+            updated += len(book_ids)
+            self.stdout.write(f'{updated} books updated')
+
+        if updated:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully rebuilt top shelves for {updated} books'))
@@ -0,0 +1,132 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from io import StringIO
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from library.benchmarks import SCENARIOS, BenchmarkContext
+from library.models import Book
+from library.search import FTS_TABLE
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(',')]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the importer, API endpoints and recommendations on '
+            'synthetic catalogs and write the results as JSON. The catalog '
+            'tables of the configured database are emptied between sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=parse_sizes,
+                            default=[10000, 100000, 1000000],
+                            help='Comma separated catalog sizes, e.g. 1e4,1e5')
+        parser.add_argument('--scenarios', type=lambda value: value.split(','),
+                            default=list(SCENARIOS),
+                            help=f"Comma separated, of: {', '.join(SCENARIOS)}")
+        parser.add_argument('--samples', type=int, default=50,
+                            help='Timed requests per latency measurement')
+        parser.add_argument('--output', type=str, default='benchmarks.json')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=1)
+        parser.add_argument('--reset', action='store_true',
+                            help='Allow deleting a catalog that is already loaded')
+
+    def handle(self, *args, **kwargs):
+        unknown = set(kwargs['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        if Book.objects.exists() and not kwargs['reset']:
+            raise CommandError(
+                'The database already holds books, run against an empty '
+                'database or pass --reset to delete them')
+
+        results = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'samples': kwargs['samples'],
+            'cache': settings.CACHES['default']['BACKEND'],
+            # See library/benchmarks.py
+            'response_cache': 'cleared before each API sample',
+            'sqlite_pragmas': (getattr(settings, 'SQLITE_PRAGMAS', {})
+                               if connection.vendor == 'sqlite' else None),
+            'sizes': {},
+        }
+
+        # The test client needs the test environment's ALLOWED_HOSTS
+        setup_test_environment()
+        try:
+            for size in kwargs['sizes']:
+                results['sizes'][str(size)] = self.run_size(size, kwargs)
+                self.write_results(kwargs['output'], results)
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully wrote benchmark results to {kwargs['output']}"))
+
+    def run_size(self, size, kwargs):
+        self.flush_catalog()
+        handle, catalog_file = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            self.stdout.write(f'Generating {size} books')
+            call_command('generate_catalog', catalog_file, books=size,
+                         seed=kwargs['seed'], stdout=StringIO())
+            context = BenchmarkContext(
+                catalog_file, size, kwargs['samples'], kwargs['seed'], {
+                    'chunk_size': kwargs['chunk_size'],
+                    'workers': kwargs['workers'],
+                })
+
+            # Every other scenario needs the catalog loaded
+            scenarios = ['import_books'] + [
+                name for name in kwargs['scenarios'] if name != 'import_books']
+            measurements = {}
+            for name in scenarios:
+                self.stdout.write(f'{size} books: {name}')
+                measurements[name] = SCENARIOS[name](context)
+                self.stdout.write(f'  {json.dumps(measurements[name])}')
+            return measurements
+        finally:
+            os.remove(catalog_file)
+            checkpoint = f'{catalog_file}.checkpoint'
+            if os.path.exists(checkpoint):
+                os.remove(checkpoint)
+
+    def flush_catalog(self):
+        tables = [
+            model._meta.db_table
+            for model in apps.get_app_config('library').get_models(
+                include_auto_created=True)
+        ]
+        if connection.vendor == 'sqlite':
+            tables.append(FTS_TABLE)
+        statements = connection.ops.sql_flush(
+            no_style(), tables, reset_sequences=True, allow_cascade=True)
+        connection.ops.execute_sql_flush(statements)
+
+    def write_results(self, path, results):
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
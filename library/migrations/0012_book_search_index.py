@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("""
+            CREATE VIRTUAL TABLE library_book_fts USING fts5(
+                title, authors, series_name, description,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        schema_editor.execute("""
+            INSERT INTO library_book_fts
+                (rowid, title, authors, series_name, description)
+            SELECT b.id, coalesce(b.title, ''),
+                   coalesce((SELECT group_concat(a.name, ' ')
+                             FROM library_book_authors ba
+                             JOIN library_author a ON a.id = ba.author_id
+                             WHERE ba.book_id = b.id), ''),
+                   coalesce(b.series_name, ''),
+                   coalesce(b.description, '')
+            FROM library_book b
+        """)
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("""
+            CREATE TABLE library_book_fts (
+                book_id bigint PRIMARY KEY
+                    REFERENCES library_book (id) ON DELETE CASCADE
+                    DEFERRABLE INITIALLY DEFERRED,
+                document tsvector NOT NULL
+            )
+        """)
+        schema_editor.execute(
+            'CREATE INDEX library_book_fts_document '
+            'ON library_book_fts USING gin (document)')
+        schema_editor.execute("""
+            INSERT INTO library_book_fts (book_id, document)
+            SELECT b.id,
+                setweight(to_tsvector('simple', coalesce(b.title, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(a.names, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(b.series_name, '')), 'C') ||
+                setweight(to_tsvector('simple', coalesce(b.description, '')), 'D')
+            FROM library_book b
+            LEFT JOIN (
+                SELECT ba.book_id, string_agg(au.name, ' ') AS names
+                FROM library_book_authors ba
+                JOIN library_author au ON au.id = ba.author_id
+                GROUP BY ba.book_id
+            ) a ON a.book_id = b.id
+        """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS library_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_book_top_shelves'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
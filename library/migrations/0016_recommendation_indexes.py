@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_userrecommendation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author_id', 'language', '-average_rating', '-ratings_count'], name='book_author_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['series_id', 'language', '-average_rating', '-ratings_count'], name='book_series_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['language', '-average_rating', '-ratings_count'], name='book_language_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookshelf',
+            index=models.Index(fields=['book', '-count'], name='bookshelf_book_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookshelf',
+            index=models.Index(fields=['shelf', 'book'], name='bookshelf_shelf_book_idx'),
+        ),
+    ]
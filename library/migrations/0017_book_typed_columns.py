@@ -0,0 +1,155 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:56
+
+import datetime
+import re
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+RAW_COLUMNS = ['publication_date', 'original_publication_date',
+               'rating_dist', 'isbn', 'isbn13']
+
+# The parsing below is a copy of library.normalize as of this migration,
+# so that later changes to the module don't change what it writes
+RATING_STARS = (5, 4, 3, 2, 1)
+TYPED_BOOK_COLUMNS = [
+    'published_date', 'original_published_date',
+    *[f'rating_{star}_count' for star in RATING_STARS],
+    'normalized_isbn10', 'normalized_isbn13',
+]
+DATE_PATTERN = re.compile(r'^\s*(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?')
+
+
+def parse_date(value):
+    match = DATE_PATTERN.match(value or '')
+    if match is None:
+        return None
+    year, month, day = (int(part) if part else 1 for part in match.groups())
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_rating_dist(value):
+    counts = dict.fromkeys(RATING_STARS)
+    for part in (value or '').split('|'):
+        star, _, count = part.partition(':')
+        try:
+            star, count = int(star), int(count)
+        except ValueError:
+            continue
+        if star in counts:
+            counts[star] = count
+    return counts
+
+
+def isbn_characters(value):
+    return re.sub(r'[^0-9X]', '', (value or '').upper())
+
+
+def normalize_isbn10(value):
+    isbn = isbn_characters(value)
+    if not re.fullmatch(r'\d{9}[\dX]', isbn):
+        return None
+    return isbn
+
+
+def normalize_isbn13(value):
+    isbn = isbn_characters(value)
+    if not re.fullmatch(r'\d{13}', isbn):
+        return None
+    return isbn
+
+
+def isbn10_to_isbn13(isbn10):
+    digits = '978' + isbn10[:9]
+    total = sum(int(digit) * (3 if index % 2 else 1)
+                for index, digit in enumerate(digits))
+    return digits + str(-total % 10)
+
+
+def typed_book_columns(publication_date, original_publication_date,
+                       rating_dist, isbn, isbn13):
+    isbn10 = normalize_isbn10(isbn)
+    counts = parse_rating_dist(rating_dist)
+    return {
+        'published_date': parse_date(publication_date),
+        'original_published_date': parse_date(original_publication_date),
+        **{f'rating_{star}_count': counts[star] for star in RATING_STARS},
+        'normalized_isbn10': isbn10,
+        'normalized_isbn13': (normalize_isbn13(isbn13)
+                              or (isbn10 and isbn10_to_isbn13(isbn10))),
+    }
+
+
+def fill_typed_columns(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    manager = Book.objects.db_manager(schema_editor.connection.alias)
+    books = manager.order_by('id')
+    last_id = 0
+    while True:
+        rows = list(books.filter(id__gt=last_id).values_list(
+            'id', *RAW_COLUMNS)[:BATCH_SIZE])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = [Book(id=row[0], **typed_book_columns(*row[1:]))
+                   for row in rows]
+        manager.bulk_update(updates, TYPED_BOOK_COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_recommendation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='normalized_isbn10',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='normalized_isbn13',
+            field=models.CharField(blank=True, db_index=True, max_length=13, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='original_published_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='published_date',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_1_count',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_2_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_3_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_4_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_5_count',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(fill_typed_columns, migrations.RunPython.noop),
+    ]
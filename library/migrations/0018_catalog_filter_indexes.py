@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_book_typed_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['-ratings_count', 'id'], name='author_ratings_count_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-ratings_count', 'id'], name='book_ratings_count_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['format', '-average_rating', '-ratings_count'], name='book_format_rank_idx'),
+        ),
+    ]
@@ -1,6 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+# Number of shelves shown with a book
+TOP_SHELVES_LIMIT = 20
+
+# Number of favorites a user can have
+FAVORITES_LIMIT = 20
+
 
 class Author(models.Model):
     api_id = models.CharField(
@@ -19,6 +25,15 @@ class Author(models.Model):
     work_ids = models.JSONField(blank=True, null=True)
     book_ids = models.JSONField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of ranked listings
+            models.Index(fields=['-average_rating', 'id'],
+                         name='author_rating_id_idx'),
+            models.Index(fields=['-ratings_count', 'id'],
+                         name='author_ratings_count_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -58,6 +73,46 @@ class Book(models.Model):
     series_name = models.CharField(max_length=255, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     series_position = models.CharField(max_length=255, null=True, blank=True)
+    # [name, count] pairs of the top BookShelf rows, BookShelf stays the
+    # source of truth
+    top_shelves = models.JSONField(null=True, blank=True)
+    # Typed copies of the free-form columns above, see library/normalize.py
+    published_date = models.DateField(null=True, blank=True, db_index=True)
+    original_published_date = models.DateField(
+        null=True, blank=True, db_index=True)
+    rating_5_count = models.IntegerField(null=True, blank=True, db_index=True)
+    rating_4_count = models.IntegerField(null=True, blank=True, db_index=True)
+    rating_3_count = models.IntegerField(null=True, blank=True, db_index=True)
+    rating_2_count = models.IntegerField(null=True, blank=True, db_index=True)
+    rating_1_count = models.IntegerField(null=True, blank=True, db_index=True)
+    normalized_isbn10 = models.CharField(max_length=10, null=True, blank=True)
+    # Also derived from the ISBN-10, lookups by either go through it
+    normalized_isbn13 = models.CharField(
+        max_length=13, null=True, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of ranked listings
+            models.Index(fields=['-average_rating', 'id'],
+                         name='book_rating_id_idx'),
+            models.Index(fields=['-ratings_count', 'id'],
+                         name='book_ratings_count_id_idx'),
+            # recommend_books candidates: equality on the source column and
+            # language, then ordered by rating
+            models.Index(fields=['author_id', 'language', '-average_rating',
+                                 '-ratings_count'],
+                         name='book_author_rank_idx'),
+            models.Index(fields=['series_id', 'language', '-average_rating',
+                                 '-ratings_count'],
+                         name='book_series_rank_idx'),
+            models.Index(fields=['language', '-average_rating',
+                                 '-ratings_count'],
+                         name='book_language_rank_idx'),
+            # Structured listing filters, see BookViewSet.exact_filters
+            models.Index(fields=['format', '-average_rating',
+                                 '-ratings_count'],
+                         name='book_format_rank_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -68,10 +123,42 @@ class BookShelf(models.Model):
     shelf = models.ForeignKey(Shelf, on_delete=models.CASCADE)
     count = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            # Top shelves of a book
+            models.Index(fields=['book', '-count'],
+                         name='bookshelf_book_count_idx'),
+            # Books on a set of shelves, without touching the table
+            models.Index(fields=['shelf', 'book'],
+                         name='bookshelf_shelf_book_idx'),
+        ]
+
     def __str__(self):
         return f"{self.book.title} on {self.shelf.name} ({self.count})"
 
 
+class BookNeighbor(models.Model):
+    """
+    Precomputed shelf similarity between two books, built offline by the
+    build_book_neighbors command.
+    """
+    book = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('book', 'neighbor')
+        indexes = [
+            models.Index(fields=['book', 'rank'], name='neighbor_book_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbor_id} ({self.score:.3f})"
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -81,3 +168,24 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.book.title}"
+
+
+class UserRecommendation(models.Model):
+    """Latest recommendations computed in the background for a user."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        RUNNING = 'running'
+        READY = 'ready'
+        FAILED = 'failed'
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name='recommendation')
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING)
+    book_ids = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+    computed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.status}"
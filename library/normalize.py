@@ -0,0 +1,100 @@
+"""
+Parsing of the dataset's free-form values into typed columns.
+
+Every function returns None for a value it can't make sense of rather
+than raising, since the dataset is not consistent.
+"""
+import datetime
+import re
+
+RATING_STARS = (5, 4, 3, 2, 1)
+
+# Columns returned by typed_book_columns
+TYPED_BOOK_COLUMNS = [
+    'published_date', 'original_published_date',
+    *[f'rating_{star}_count' for star in RATING_STARS],
+    'normalized_isbn10', 'normalized_isbn13',
+]
+
+# "2006-09-16", "2006-09" or "2006"; partial dates start their period
+DATE_PATTERN = re.compile(r'^\s*(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?')
+
+
+def parse_date(value):
+    match = DATE_PATTERN.match(value or '')
+    if match is None:
+        return None
+    year, month, day = (int(part) if part else 1 for part in match.groups())
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_rating_dist(value):
+    """
+    The per-star counts of a ``5:123|4:56|...|total:200`` string, as a
+    dict keyed by star.
+    """
+    counts = dict.fromkeys(RATING_STARS)
+    for part in (value or '').split('|'):
+        star, _, count = part.partition(':')
+        try:
+            star, count = int(star), int(count)
+        except ValueError:
+            continue
+        if star in counts:
+            counts[star] = count
+    return counts
+
+
+def isbn_characters(value):
+    return re.sub(r'[^0-9X]', '', (value or '').upper())
+
+
+def normalize_isbn10(value):
+    isbn = isbn_characters(value)
+    if not re.fullmatch(r'\d{9}[\dX]', isbn):
+        return None
+    return isbn
+
+
+def normalize_isbn13(value):
+    isbn = isbn_characters(value)
+    if not re.fullmatch(r'\d{13}', isbn):
+        return None
+    return isbn
+
+
+def isbn10_to_isbn13(isbn10):
+    digits = '978' + isbn10[:9]
+    total = sum(int(digit) * (3 if index % 2 else 1)
+                for index, digit in enumerate(digits))
+    return digits + str(-total % 10)
+
+
+def lookup_isbn13(value):
+    """The ISBN-13 a lookup by ``value``, an ISBN-10 or 13, should match."""
+    isbn13 = normalize_isbn13(value)
+    if isbn13 is not None:
+        return isbn13
+    isbn10 = normalize_isbn10(value)
+    if isbn10 is not None:
+        return isbn10_to_isbn13(isbn10)
+    return None
+
+
+def typed_book_columns(publication_date, original_publication_date,
+                       rating_dist, isbn, isbn13):
+    """The typed Book columns derived from the raw dataset values."""
+    isbn10 = normalize_isbn10(isbn)
+    counts = parse_rating_dist(rating_dist)
+    return {
+        'published_date': parse_date(publication_date),
+        'original_published_date': parse_date(original_publication_date),
+        **{f'rating_{star}_count': counts[star] for star in RATING_STARS},
+        'normalized_isbn10': isbn10,
+        # Books listed with only an ISBN-10 can still be found by ISBN-13
+        'normalized_isbn13': (normalize_isbn13(isbn13)
+                              or (isbn10 and isbn10_to_isbn13(isbn10))),
+    }
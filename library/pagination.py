@@ -0,0 +1,192 @@
+import base64
+import json
+from functools import reduce
+from operator import and_, or_
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the ordering columns instead of using
+    OFFSET, and never counts the queryset.
+
+    Orderings always end with ``id`` so every cursor points at exactly one
+    row. Rows with a NULL ordering column are left out, since they can't be
+    compared against a cursor.
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    page_size = api_settings.PAGE_SIZE
+    orderings = {
+        'id': ('id',),
+        '-average_rating': ('-average_rating', 'id'),
+        '-ratings_count': ('-ratings_count', 'id'),
+    }
+    default_ordering = 'id'
+    # Columns a page's rows must hold to encode cursors
+    cursor_columns = tuple(dict.fromkeys(
+        field.lstrip('-') for ordering in orderings.values()
+        for field in ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        ordering = self.get_ordering(request)
+        position, reverse = self.decode_cursor(
+            request, ordering, queryset.model)
+
+        if reverse:
+            ordering = tuple(self.reverse_field(field) for field in ordering)
+        for field in ordering:
+            if field.lstrip('-') != 'id':
+                queryset = queryset.filter(**{f"{field.lstrip('-')}__isnull": False})
+        if position is not None:
+            queryset = queryset.filter(self.seek(ordering, position))
+
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            ordering = tuple(self.reverse_field(field) for field in ordering)
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = position is not None if not reverse else has_more
+        self.ordering = ordering
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_ordering(self, request):
+        name = request.query_params.get(
+            self.ordering_query_param, self.default_ordering)
+        if name not in self.orderings:
+            raise ValidationError({self.ordering_query_param: [
+                f"Supported orderings: {', '.join(self.orderings)}."
+            ]})
+        return self.orderings[name]
+
+    def decode_cursor(self, request, ordering, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+            if len(position) != len(ordering):
+                raise ValueError
+            # Cursors come from the client, their values must fit the
+            # columns they are compared with
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(ordering, position)
+            ]
+            if None in position:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound('Invalid cursor')
+        return position, reverse
+
+    def encode_cursor(self, obj, reverse):
+        # Pages hold model instances or, on the row serialization path, dicts
+        if isinstance(obj, dict):
+            position = [obj[field.lstrip('-')] for field in self.ordering]
+        else:
+            position = [getattr(obj, field.lstrip('-'))
+                        for field in self.ordering]
+        cursor = json.dumps({'p': position, 'r': int(reverse)},
+                            cls=DjangoJSONEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    @staticmethod
+    def reverse_field(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def seek(ordering, position):
+        """
+        Rows strictly after ``position``: (a, b) > (x, y) expands to
+        a > x OR (a = x AND b > y), with > flipped for descending columns.
+        """
+        clauses = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value
+                for previous, value in zip(ordering[:index], position)
+            }
+            clauses.append(reduce(and_, [
+                Q(**equal), Q(**{f'{name}__{lookup}': position[index]})
+            ]))
+        return reduce(or_, clauses)
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page-number pagination unless the client opts into keyset pagination
+    with ``?paginate=cursor``; links returned from cursor pages carry the
+    opt-in along. Both take the same ``?ordering=`` names; only keyset
+    pagination leaves out rows with a NULL ordering column.
+    """
+    mode_query_param = 'paginate'
+    cursor_class = KeysetPagination
+    cursor_columns = cursor_class.cursor_columns
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_class.cursor_query_param in request.query_params):
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        # An explicit ordering wins, the default one only keeps pages
+        # stable and must not undo an ordering such as search relevance
+        if (self.cursor_class.ordering_query_param in request.query_params
+                or not queryset.ordered):
+            queryset = queryset.order_by(
+                *self.cursor_class().get_ordering(request))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,175 @@
+"""
+Opt-in per-request profiling.
+
+ProfilingMiddleware records, for each request, the number of SQL queries
+and the time spent in them, the slowest queries, the time spent in
+serializer ``.data`` and in rendering the response. It adds them to the
+response as a ``Server-Timing`` header and logs one JSON line per request
+to the ``library.profiling`` logger. Statements run several times with
+different parameters, the usual sign of an N+1 query, are logged as a
+warning once they repeat REQUEST_PROFILING_DUPLICATE_THRESHOLD times.
+
+Timings overlap: queries run while serializing count towards both
+``sql`` and ``serialize``. Enable with REQUEST_PROFILING = True.
+"""
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_current_profile = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self, slow_query_count):
+        self.slow_query_count = slow_query_count
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.slow_queries = []
+        self.sections = Counter()
+        self._depth = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed as a database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started,
+                              context['connection'].alias)
+
+    def record_query(self, sql, duration, alias):
+        self.query_count += 1
+        self.sql_time += duration
+        self.statements[sql] += 1
+        self.slow_queries.append((duration, alias, sql))
+        if len(self.slow_queries) > self.slow_query_count:
+            self.slow_queries.sort(key=lambda query: query[0], reverse=True)
+            del self.slow_queries[self.slow_query_count:]
+
+    def add(self, section, duration):
+        self.sections[section] += duration
+
+    def duplicates(self, threshold):
+        return {sql: count for sql, count in self.statements.items()
+                if count >= threshold}
+
+    def server_timing(self, total):
+        metrics = [
+            f'sql;dur={self.sql_time * 1000:.1f};desc="{self.query_count} queries"'
+        ]
+        if self.slow_queries:
+            metrics.append(f'sql-slowest;dur={self.slowest_time() * 1000:.1f}')
+        metrics.extend(f'{section};dur={duration * 1000:.1f}'
+                       for section, duration in self.sections.items())
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def slowest_time(self):
+        return max(duration for duration, _, _ in self.slow_queries)
+
+    def as_dict(self, request, response, total, duplicates):
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 3),
+            'query_count': self.query_count,
+            'sql_ms': round(self.sql_time * 1000, 3),
+            **{f'{section}_ms': round(duration * 1000, 3)
+               for section, duration in self.sections.items()},
+            'slowest_queries': [
+                {'ms': round(duration * 1000, 3), 'alias': alias, 'sql': sql}
+                for duration, alias, sql in sorted(
+                    self.slow_queries, key=lambda query: query[0],
+                    reverse=True)
+            ],
+            'duplicate_queries': [
+                {'count': count, 'sql': sql}
+                for sql, count in duplicates.items()
+            ],
+        }
+
+
+@contextmanager
+def profile_section(section):
+    """Add the time spent in the block to ``section`` of the current request."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+
+    # Only the outermost block counts when sections nest
+    profile._depth[section] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile._depth[section] -= 1
+        if not profile._depth[section]:
+            profile.add(section, time.perf_counter() - started)
+
+
+class ProfiledSerializerMixin:
+    """Counts the time spent producing ``.data`` as serializer time."""
+
+    @property
+    def data(self):
+        with profile_section('serialize'):
+            return super().data
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(
+            settings, 'REQUEST_PROFILING_DUPLICATE_THRESHOLD', 5)
+        self.slow_query_count = getattr(
+            settings, 'REQUEST_PROFILING_SLOW_QUERIES', 3)
+
+    def __call__(self, request):
+        profile = RequestProfile(self.slow_query_count)
+        token = _current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        total = time.perf_counter() - profile.started
+        duplicates = profile.duplicates(self.duplicate_threshold)
+        response['Server-Timing'] = profile.server_timing(total)
+        record = profile.as_dict(request, response, total, duplicates)
+        logger.info(json.dumps(record))
+        if duplicates:
+            logger.warning(
+                'Possible N+1 queries on %s %s: %s', request.method,
+                request.path, json.dumps(record['duplicate_queries']))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        profile = _current_profile.get()
+        if profile is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                profile.add('render', time.perf_counter() - started)
+
+            response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,47 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer using orjson when it is installed.
+
+    Produces the same bytes as JSONRenderer for compact, non-ASCII-escaped
+    output, which are the REST framework defaults. Indented output and
+    anything orjson can't encode go through JSONRenderer.
+    """
+    options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+               if orjson is not None else 0)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact or self.get_indent(
+                    accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            # Dates are left to the REST framework encoder, which formats
+            # them differently from orjson
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace(
+            '\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class StreamContentNegotiation(DefaultContentNegotiation):
+    """
+    For views that return a response of their own, whose type is not up
+    to the Accept header. Errors are rendered by the first renderer,
+    whatever the client accepts.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
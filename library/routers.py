@@ -0,0 +1,110 @@
+"""
+Database routing between the primary and read replicas.
+
+Reads of the catalog models go to one of the REPLICA_DATABASES aliases,
+picked at random. Everything else, and every write, uses the primary.
+Reads also stay on the primary:
+
+* inside a transaction on the primary, which a replica can't see
+* for the whole of a request with an unsafe method
+* for REPLICA_PIN_SECONDS after the requesting user wrote something,
+  so they see their own writes despite replication lag
+* within ``pin_to_primary()``
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY = DEFAULT_DB_ALIAS
+
+CATALOG_MODELS = {
+    'library.author',
+    'library.book',
+    'library.book_authors',
+    'library.bookneighbor',
+    'library.bookshelf',
+    'library.shelf',
+}
+
+_pinned = ContextVar('pinned_to_primary', default=False)
+_current_request = ContextVar('replica_request', default=None)
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Keep ``user_id``'s reads on the primary for REPLICA_PIN_SECONDS."""
+    timeout = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    cache.set(pin_key(user_id), time.time(), timeout)
+
+
+def is_user_pinned(user_id):
+    return cache.get(pin_key(user_id)) is not None
+
+
+@contextmanager
+def pin_to_primary(pinned=True):
+    token = _pinned.set(pinned or _pinned.get())
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def request_is_pinned(request):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return True
+    # REST framework sets request.user once it has authenticated
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    cached = getattr(request, '_replica_pin', None)
+    if cached is None or cached[0] != user.pk:
+        cached = request._replica_pin = (user.pk, is_user_pinned(user.pk))
+    return cached[1]
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'REPLICA_DATABASES', [])
+        if (not replicas
+                or model._meta.label_lower not in CATALOG_MODELS
+                or _pinned.get()
+                or connections[PRIMARY].in_atomic_block):
+            return PRIMARY
+        request = _current_request.get()
+        if request is not None and request_is_pinned(request):
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in getattr(settings, 'REPLICA_DATABASES', [])
+
+
+class ReplicaPinningMiddleware:
+    """Lets ReplicaRouter see the request whose queries it is routing."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_request.reset(token)
@@ -0,0 +1,162 @@
+"""
+Read-only serialization straight from ``.values()`` rows.
+
+ModelSerializer resolves every field of every row through get_attribute
+and to_representation. For the high-volume list endpoints, RowSerializer
+compiles a serializer's fields once into (key, column, converter)
+triples and applies them to plain dicts, without building model
+instances. The payloads are identical to the serializer's.
+"""
+import copy
+from collections import defaultdict
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.response import Response
+
+from library.models import Book
+from library.profiling import profile_section
+from library.utils import ranked_top_shelves
+
+# Fields whose to_representation is just the type conversion, called
+# directly instead of through the field
+CONVERTERS = {
+    serializers.CharField.to_representation: str,
+    serializers.IntegerField.to_representation: int,
+    serializers.FloatField.to_representation: float,
+}
+
+
+class RowSerializer:
+    """
+    Payloads of ``serializer_class`` built from ``.values()`` rows.
+
+    Every readable field must be a model column, except those named in
+    ``related_fields``, which subclasses fill in ``add_related`` from the
+    columns listed for them.
+    """
+    related_fields = ()
+    # Related field name -> the columns add_related needs to fill it
+    related_columns = {}
+
+    def __init__(self, serializer_class):
+        if (self.related_fields
+                and type(self).add_related is RowSerializer.add_related):
+            raise ImproperlyConfigured(
+                f'{type(self).__name__} has related_fields but does not '
+                f'override add_related')
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only or name in self.related_fields:
+                continue
+            if (isinstance(field, (RelatedField, ManyRelatedField,
+                                   serializers.SerializerMethodField))
+                    or field.source == '*' or '.' in field.source):
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} is not a model '
+                    f'column and is not in related_fields')
+            converter = CONVERTERS.get(
+                type(field).to_representation, field.to_representation)
+            self.fields.append((name, field.source, converter))
+
+    def select(self, names):
+        """A copy producing only the fields in ``names``."""
+        selected = copy.copy(self)
+        selected.fields = [field for field in self.fields if field[0] in names]
+        selected.related_fields = tuple(
+            name for name in self.related_fields if name in names)
+        return selected
+
+    def values(self, queryset, extra_columns=()):
+        columns = [source for _, source, _ in self.fields]
+        for name in self.related_fields:
+            extra_columns = (*self.related_columns.get(name, ()), *extra_columns)
+        columns += [column for column in dict.fromkeys(extra_columns)
+                    if column not in columns]
+        # Extra selects used for ordering, such as a search rank, must be
+        # selected explicitly once values() is used
+        columns += list(queryset.query.extra_select)
+        # prefetch_related() can't apply to dicts
+        return queryset.prefetch_related(None).values(*columns)
+
+    def to_representation(self, rows):
+        fields = self.fields
+        payloads = [
+            {
+                name: None if row[source] is None else converter(row[source])
+                for name, source, converter in fields
+            }
+            for row in rows
+        ]
+        if self.related_fields:
+            self.add_related(rows, payloads)
+        return payloads
+
+    def add_related(self, rows, payloads):
+        """Fill the ``related_fields`` of ``payloads`` in place."""
+
+
+class BookRowSerializer(RowSerializer):
+    related_fields = ('authors', 'shelves')
+    related_columns = {
+        'authors': ('id',),
+        'shelves': ('id', 'top_shelves'),
+    }
+
+    def add_related(self, rows, payloads):
+        if 'authors' in self.related_fields:
+            self.add_authors(rows, payloads)
+        if 'shelves' in self.related_fields:
+            self.add_shelves(rows, payloads)
+
+    def add_authors(self, rows, payloads):
+        # Same order as prefetch_book_relations
+        author_ids = defaultdict(list)
+        links = (
+            Book.authors.through.objects
+            .filter(book_id__in=[row['id'] for row in rows])
+            .order_by('book_id', 'author_id')
+            .values_list('book_id', 'author_id')
+        )
+        for book_id, author_id in links:
+            author_ids[book_id].append(author_id)
+
+        for row, payload in zip(rows, payloads):
+            payload['authors'] = author_ids[row['id']]
+
+    def add_shelves(self, rows, payloads):
+        missing = [row['id'] for row in rows if row['top_shelves'] is None]
+        ranked = ranked_top_shelves(missing) if missing else {}
+
+        for row, payload in zip(rows, payloads):
+            top_shelves = row['top_shelves']
+            if top_shelves is None:
+                top_shelves = ranked[row['id']]
+            # BookSerializer puts shelves last
+            payload['shelves'] = [
+                {'name': name, 'count': count} for name, count in top_shelves
+            ]
+
+
+class RowListMixin:
+    """Serves ``list`` through ``row_serializer`` instead of the serializer."""
+    row_serializer = None
+
+    def get_row_serializer(self):
+        return self.row_serializer
+
+    def list(self, request, *args, **kwargs):
+        row_serializer = self.get_row_serializer()
+        # Keyset pagination reads the cursor position from the rows
+        rows = row_serializer.values(
+            self.filter_queryset(self.get_queryset()),
+            getattr(self.paginator, 'cursor_columns', ()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            page = list(rows)
+        with profile_section('serialize'):
+            data = row_serializer.to_representation(page)
+        if self.paginator is None:
+            return Response(data)
+        return self.get_paginated_response(data)
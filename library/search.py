@@ -0,0 +1,154 @@
+"""
+Full-text search over books.
+
+Search documents live in the ``library_book_fts`` side table, keyed by
+book id: an FTS5 virtual table on SQLite and a tsvector column with a GIN
+index on PostgreSQL. Other backends fall back to DRF's ``LIKE`` search.
+"""
+import re
+
+from django.db import connections
+from rest_framework import filters
+
+from library.models import Book
+
+FTS_TABLE = 'library_book_fts'
+
+# Ids refreshed per statement, PostgreSQL binds them twice
+INDEX_BATCH_SIZE = 400
+
+# Same weights as the columns' order: title, authors, series, description
+POSTGRES_DOCUMENT = """
+    setweight(to_tsvector('simple', coalesce(b.title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(a.names, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(b.series_name, '')), 'C') ||
+    setweight(to_tsvector('simple', coalesce(b.description, '')), 'D')
+"""
+
+
+def is_supported(using='default'):
+    return connections[using].vendor in ('sqlite', 'postgresql')
+
+
+def index_books(book_ids, using='default'):
+    """Refresh the search documents of ``book_ids`` from their current rows."""
+    if not is_supported(using):
+        return
+
+    book_ids = list(book_ids)
+    for begin in range(0, len(book_ids), INDEX_BATCH_SIZE):
+        _index_batch(book_ids[begin:begin + INDEX_BATCH_SIZE], using)
+
+
+def unindex_books(book_ids, using='default'):
+    """Drop the search documents of deleted books."""
+    # PostgreSQL's documents cascade with their book
+    if connections[using].vendor != 'sqlite':
+        return
+
+    book_ids = list(book_ids)
+    for begin in range(0, len(book_ids), INDEX_BATCH_SIZE):
+        batch = book_ids[begin:begin + INDEX_BATCH_SIZE]
+        placeholders = ', '.join(['%s'] * len(batch))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                batch)
+
+
+def _index_batch(book_ids, using):
+    connection = connections[using]
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                book_ids)
+            cursor.execute(f"""
+                INSERT INTO {FTS_TABLE}
+                    (rowid, title, authors, series_name, description)
+                SELECT b.id, coalesce(b.title, ''),
+                       coalesce((SELECT group_concat(a.name, ' ')
+                                 FROM library_book_authors ba
+                                 JOIN library_author a ON a.id = ba.author_id
+                                 WHERE ba.book_id = b.id), ''),
+                       coalesce(b.series_name, ''),
+                       coalesce(b.description, '')
+                FROM library_book b
+                WHERE b.id IN ({placeholders})
+            """, book_ids)
+        else:
+            cursor.execute(f"""
+                INSERT INTO {FTS_TABLE} (book_id, document)
+                SELECT b.id, {POSTGRES_DOCUMENT}
+                FROM library_book b
+                LEFT JOIN (
+                    SELECT ba.book_id, string_agg(au.name, ' ') AS names
+                    FROM library_book_authors ba
+                    JOIN library_author au ON au.id = ba.author_id
+                    WHERE ba.book_id IN ({placeholders})
+                    GROUP BY ba.book_id
+                ) a ON a.book_id = b.id
+                WHERE b.id IN ({placeholders})
+                ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document
+            """, book_ids + book_ids)
+
+
+def match_expression(terms):
+    # Quote every term so user input can't inject FTS5 query syntax, and
+    # allow prefix matches like LIKE did
+    return ' '.join(
+        '"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def tsquery_expression(terms):
+    # Keep only word characters, the rest is tsquery syntax
+    words = re.findall(r'\w+', ' '.join(terms))
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search(queryset, terms):
+    """
+    Restrict ``queryset`` to books matching every term, best matches first.
+    """
+    connection = connections[queryset.db]
+    book_table = Book._meta.db_table
+    if connection.vendor == 'sqlite':
+        # bm25 ranks lower values as more relevant
+        condition = f'{FTS_TABLE} MATCH %s'
+        rank = f'{FTS_TABLE}.rank'
+        rank_params = []
+        join = f'{FTS_TABLE}.rowid = {book_table}.id'
+        query = match_expression(terms)
+    else:
+        condition = f"{FTS_TABLE}.document @@ to_tsquery('simple', %s)"
+        rank = f"-ts_rank({FTS_TABLE}.document, to_tsquery('simple', %s))"
+        join = f'{FTS_TABLE}.book_id = {book_table}.id'
+        query = tsquery_expression(terms)
+        rank_params = [query]
+
+    # A join lets the database rank every match in one pass, a correlated
+    # subquery would evaluate the match once per row
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[join, condition],
+        params=[query],
+        select={'search_rank': rank},
+        select_params=rank_params,
+    ).order_by('search_rank', 'id')
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter backed by the full-text index, ranking results by
+    relevance. Falls back to the view's ``search_fields`` when the database
+    has no full-text support.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        if not is_supported(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return search(queryset, terms)
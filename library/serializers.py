@@ -1,23 +1,83 @@
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
-from .models import Author, Book, BookShelf, Favorite
+from .models import (
+    Author, Book, BookShelf, Favorite, FAVORITES_LIMIT, TOP_SHELVES_LIMIT)
+from .fieldsets import SparseFieldsSerializerMixin
+from .profiling import ProfiledSerializerMixin
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+def top_shelves_prefetch():
+    # Sliced prefetches are ranked with a window function, so a whole page
+    # of books gets its top shelves in a single query
+    return Prefetch(
+        'bookshelf_set',
+        queryset=BookShelf.objects.select_related(
+            'shelf').order_by('-count')[:TOP_SHELVES_LIMIT],
+        to_attr='top_bookshelves',
+    )
+
+
+def authors_prefetch():
+    # Ordered so the payload doesn't depend on the query plan, the row
+    # serialization path uses the same order
+    return Prefetch('authors', queryset=Author.objects.order_by('id'))
+
+
+def prefetch_book_relations(books):
+    """Load what BookSerializer needs for ``books``, a queryset or list."""
+    if isinstance(books, list):
+        prefetch_related_objects(books, authors_prefetch())
+        return books
+    return books.prefetch_related(authors_prefetch())
+
+
+class ProfiledListSerializer(ProfiledSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+class AuthorSerializer(SparseFieldsSerializerMixin, ProfiledSerializerMixin,
+                       serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = '__all__'
+        list_serializer_class = ProfiledListSerializer
+
+
+class BookListSerializer(ProfiledListSerializer):
+    def to_representation(self, data):
+        books = list(data.all() if isinstance(data, BaseManager) else data)
 
+        # Books whose top_shelves column has not been filled yet get their
+        # shelves in one batched query instead of one query each
+        missing = [book for book in books if book.top_shelves is None
+                   and not hasattr(book, 'top_bookshelves')]
+        if missing:
+            prefetch_related_objects(missing, top_shelves_prefetch())
+        return super().to_representation(books)
 
-class BookSerializer(serializers.ModelSerializer):
+
+class BookSerializer(SparseFieldsSerializerMixin, ProfiledSerializerMixin,
+                     serializers.ModelSerializer):
     shelves = serializers.SerializerMethodField()
 
     class Meta:
         model = Book
-        fields = '__all__'
+        exclude = ['top_shelves']
+        list_serializer_class = BookListSerializer
 
     def get_shelves(self, obj):
-        # Get the related BookShelf objects and find the one with the highest count
-        shelves = BookShelf.objects.filter(book=obj).order_by('-count')[:20]
+        if obj.top_shelves is not None:
+            return [
+                {"name": name, "count": count}
+                for name, count in obj.top_shelves
+            ]
+
+        # Use the shelves prefetched for the page when available
+        shelves = getattr(obj, 'top_bookshelves', None)
+        if shelves is None:
+            shelves = BookShelf.objects.filter(book=obj).select_related(
+                'shelf').order_by('-count')[:TOP_SHELVES_LIMIT]
         if shelves is None:
             return None
         return [
@@ -42,8 +102,34 @@ class BookSerializer(serializers.ModelSerializer):
         return representation
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Favorite
         fields = ['user', 'book']
         read_only_fields = ['user']
+        list_serializer_class = ProfiledListSerializer
+
+
+def book_id_list():
+    # Ids outside the bigint range would overflow the lookups
+    return serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=2 ** 63 - 1),
+        required=False, default=list, max_length=FAVORITES_LIMIT)
+
+
+class BulkFavoriteSerializer(serializers.Serializer):
+    """Book ids to add to and remove from the user's favorites at once."""
+    add = book_id_list()
+    remove = book_id_list()
+
+    def validate(self, attrs):
+        # Keep the first occurrence of each id, in request order
+        attrs = {name: list(dict.fromkeys(ids)) for name, ids in attrs.items()}
+        both = set(attrs['add']) & set(attrs['remove'])
+        if both:
+            raise serializers.ValidationError(
+                f"Books both added and removed: "
+                f"{', '.join(map(str, sorted(both)))}.")
+        if not (attrs['add'] or attrs['remove']):
+            raise serializers.ValidationError('Nothing to add or remove.')
+        return attrs
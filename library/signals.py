@@ -0,0 +1,104 @@
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete)
+from django.dispatch import receiver
+
+from library.caching import (
+    bump_favorites_version, bump_object_version, bump_version,
+    list_version_key)
+from library.models import Author, Book, BookShelf, Favorite
+from library.routers import pin_user
+from library.search import index_books, unindex_books
+from library.sqlite import configure_connection
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        configure_connection(connection)
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+def invalidate_favorite_recommendations(sender, instance, **kwargs):
+    bump_favorites_version(instance.user_id)
+    pin_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def pin_saved_user(sender, instance, **kwargs):
+    pin_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Book)
+def invalidate_catalog_object(sender, instance, **kwargs):
+    bump_object_version(sender, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=BookShelf)
+def invalidate_book_shelves(sender, instance, **kwargs):
+    bump_object_version(Book, instance.book_id)
+
+
+# Bulk imports skip these signals and index the books they write
+# themselves
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, using, **kwargs):
+    index_books([instance.pk], using)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, using, **kwargs):
+    unindex_books([instance.pk], using)
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, using, created, **kwargs):
+    # Search documents hold author names, and so decide which books a
+    # cached search listing returns
+    if not created:
+        index_books(Book.objects.using(using).filter(authors=instance)
+                    .values_list('pk', flat=True), using)
+        bump_version(list_version_key(Book))
+
+
+def refresh_books(book_ids, using):
+    """Cached payloads and search documents of books whose authors changed."""
+    book_ids = list(book_ids)
+    for book_id in book_ids:
+        bump_object_version(Book, book_id)
+    index_books(book_ids, using)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def refresh_linked_books(sender, instance, action, reverse, pk_set, using,
+                         **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_books([instance.pk], using)
+        return
+
+    # Changed from the author's side, instance is an Author. Cleared books
+    # are only known before the clear
+    if action == 'pre_clear':
+        instance._cleared_book_ids = list(
+            Book.objects.using(using).filter(authors=instance)
+            .values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_books(instance.__dict__.pop('_cleared_book_ids', []), using)
+    elif action in ('post_add', 'post_remove'):
+        refresh_books(pk_set, using)
+
+
+@receiver(pre_delete, sender=Author)
+def collect_author_books(sender, instance, using, **kwargs):
+    # The author's links are deleted with it without an m2m_changed signal
+    instance._linked_book_ids = list(
+        Book.objects.using(using).filter(authors=instance)
+        .values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def refresh_author_books(sender, instance, using, **kwargs):
+    refresh_books(instance.__dict__.pop('_linked_book_ids', []), using)
@@ -0,0 +1,59 @@
+"""
+SQLite connection tuning.
+
+Every new SQLite connection gets the SQLITE_PRAGMAS setting applied, see
+signals.py. bulk_load applies SQLITE_BULK_LOAD_PRAGMAS on top of them for
+the duration of an import and restores the previous values afterwards.
+"""
+import re
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Pragma names and values are interpolated, they can't be bound
+PRAGMA_TOKEN = re.compile(r'^-?\w+$')
+
+
+def set_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        if not (PRAGMA_TOKEN.match(name) and PRAGMA_TOKEN.match(str(value))):
+            raise ImproperlyConfigured(
+                f'Invalid SQLite pragma {name!r} = {value!r}')
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def get_pragma(cursor, name):
+    cursor.execute(f'PRAGMA {name}')
+    return cursor.fetchone()[0]
+
+
+def configure_connection(connection):
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            set_pragmas(cursor, pragmas)
+
+
+@contextmanager
+def bulk_load(using=DEFAULT_DB_ALIAS):
+    """Apply the bulk-load pragmas to ``using`` within the block."""
+    connection = connections[using]
+    pragmas = getattr(settings, 'SQLITE_BULK_LOAD_PRAGMAS', {})
+    if connection.vendor != 'sqlite' or not pragmas:
+        yield
+        return
+
+    with connection.cursor() as cursor:
+        previous = {name: get_pragma(cursor, name) for name in pragmas}
+        set_pragmas(cursor, pragmas)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            set_pragmas(cursor, previous)
+            if get_pragma(cursor, 'journal_mode') == 'wal':
+                # Fold the import back into the database file so the WAL
+                # doesn't stay at its peak size
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
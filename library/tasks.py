@@ -0,0 +1,84 @@
+"""
+Background computation of recommendations.
+
+Jobs run on a single in-process worker thread, so they are handled in
+the order they were scheduled and need no external broker. Results are
+stored on UserRecommendation, which the API serves. Setting
+RECOMMENDATIONS_ASYNC to False runs jobs inline when the scheduling
+transaction commits, which is what the tests use.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from library.caching import cached_recommend_books
+from library.models import UserRecommendation
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix='recommendations')
+# Users with a job waiting in the queue, further requests are merged into it
+_queued = set()
+_queued_lock = threading.Lock()
+
+
+def schedule_recommendations(user):
+    """Mark the user's recommendations stale and recompute them after commit."""
+    # A single upsert statement: a read followed by a write in one
+    # transaction fails straight away on SQLite while the worker is writing
+    UserRecommendation.objects.bulk_create(
+        [UserRecommendation(
+            user_id=user.id, status=UserRecommendation.Status.PENDING)],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['status', 'updated_at'],
+    )
+    transaction.on_commit(lambda: _submit(user.id))
+
+
+def _submit(user_id):
+    if not getattr(settings, 'RECOMMENDATIONS_ASYNC', True):
+        compute_recommendations(user_id)
+        return
+
+    with _queued_lock:
+        if user_id in _queued:
+            return
+        _queued.add(user_id)
+    _executor.submit(_run_job, user_id)
+
+
+def _run_job(user_id):
+    with _queued_lock:
+        _queued.discard(user_id)
+    close_old_connections()
+    try:
+        compute_recommendations(user_id)
+    finally:
+        close_old_connections()
+
+
+def compute_recommendations(user_id):
+    UserRecommendation.objects.filter(user_id=user_id).update(
+        status=UserRecommendation.Status.RUNNING, updated_at=timezone.now())
+    try:
+        # recommend_books reads the favorites from the primary, a job
+        # mostly follows a change a replica may not have yet
+        book_ids = [book.id
+                    for book in cached_recommend_books(User(id=user_id))]
+    except Exception:
+        logger.exception('Computing recommendations for user %s failed', user_id)
+        UserRecommendation.objects.filter(user_id=user_id).update(
+            status=UserRecommendation.Status.FAILED, updated_at=timezone.now())
+        return
+
+    now = timezone.now()
+    UserRecommendation.objects.filter(user_id=user_id).update(
+        status=UserRecommendation.Status.READY, book_ids=book_ids,
+        updated_at=now, computed_at=now)
@@ -1,3 +1,1789 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.db.models import Count, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .management.commands import import_books as import_books_command
+from .management.commands.import_books import shard_ranges
+from .export import CatalogExport
+from .models import Author, Book, BookNeighbor, BookShelf, Favorite, Shelf
+from .pagination import KeysetPagination
+from .normalize import (
+    isbn10_to_isbn13, lookup_isbn13, parse_date, parse_rating_dist)
+from .profiling import ProfilingMiddleware
+from .renderers import FastJSONRenderer
+from .routers import (
+    ReplicaPinningMiddleware, ReplicaRouter, is_user_pinned, pin_key,
+    pin_to_primary, pin_user)
+from .rows import BookRowSerializer, RowSerializer
+from .serializers import (
+    AuthorSerializer, BookSerializer, prefetch_book_relations)
+from .sqlite import bulk_load, get_pragma
+from .views import BookViewSet
+from .caching import (
+    CATALOG_VERSION_KEY, bump_catalog_version, cached_recommend_books,
+    object_version_key, recommendation_cache_key, recommendation_cache_stats)
+from .utils import recommend_books
+
+
+def make_record(api_id, **overrides):
+    record = {
+        'id': str(api_id),
+        'title': f'Book {api_id}',
+        'author_name': f'Author {api_id % 3}',
+        'author_id': str(api_id % 3),
+        'work_id': str(api_id),
+        'isbn': '',
+        'isbn13': '',
+        'language': 'eng',
+        'average_rating': '4.1',
+        'rating_dist': '5:10|4:5|3:1|2:0|1:0|total:16',
+        'ratings_count': '16',
+        'text_reviews_count': '2',
+        'publication_date': '2001-01-01',
+        'original_publication_date': '2000-01-01',
+        'format': 'Paperback',
+        'edition_information': '',
+        'image_url': '',
+        'publisher': 'Publisher',
+        'num_pages': '320',
+        'series_id': '',
+        'series_name': '',
+        'series_position': '',
+        'description': 'A book.',
+        'authors': [{'id': str(api_id % 3), 'name': f'Author {api_id % 3}',
+                     'role': ''}],
+        'shelves': [{'name': 'to-read', 'count': 10 + api_id},
+                    {'name': f'shelf-{api_id % 2}', 'count': 3}],
+    }
+    record.update(overrides)
+    return record
+
+
+def run_in_new_process(code):
+    """Run ``code`` in a separate interpreter set up with the settings."""
+    subprocess.run(
+        [sys.executable, '-c', f'import django; django.setup(); {code}'],
+        cwd=settings.BASE_DIR, check=True, capture_output=True,
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'project.settings'})
+
+
+class ImportFileMixin:
+    def setUp(self):
+        # Version stamps and cached responses outlive each test's
+        # rolled back transaction, and primary keys get reused
+        cache.clear()
+
+    def write_dataset(self, records):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+        self.addCleanup(os.remove, path)
+        self.addCleanup(self.remove_checkpoint, path)
+        return path
+
+    def remove_checkpoint(self, path):
+        if os.path.exists(f'{path}.checkpoint'):
+            os.remove(f'{path}.checkpoint')
+
+    def import_books(self, path, **options):
+        call_command('import_books', path, stdout=StringIO(), **options)
+
+
+class ImportBooksTests(ImportFileMixin, TestCase):
+    def test_chunked_import_creates_books_and_relations(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 8)])
+
+        self.import_books(path, chunk_size=3)
+
+        self.assertEqual(Book.objects.count(), 7)
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertEqual(Shelf.objects.count(), 3)
+        self.assertEqual(BookShelf.objects.count(), 14)
+        book = Book.objects.get(dataset_api_id='4')
+        self.assertEqual(book.average_rating, 4.1)
+        self.assertEqual(book.num_pages, 320)
+        self.assertEqual(list(book.authors.values_list('api_id', flat=True)),
+                         ['1'])
+
+    def test_reimport_updates_without_duplicating(self):
+        self.import_books(self.write_dataset([make_record(1)]))
+        path = self.write_dataset([make_record(1, title='Renamed')])
+
+        self.import_books(path)
+
+        book = Book.objects.get()
+        self.assertEqual(book.title, 'Renamed')
+        self.assertEqual(book.authors.count(), 1)
+        self.assertEqual(BookShelf.objects.filter(book=book).count(), 2)
+
+    def test_start_and_limit(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 8)])
+
+        self.import_books(path, start=3, limit=2, chunk_size=1)
+
+        self.assertEqual(
+            sorted(Book.objects.values_list('dataset_api_id', flat=True)),
+            ['3', '4'])
+
+    def test_parallel_workers_import_every_line_once(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 30)])
+
+        self.import_books(path, workers=3, chunk_size=4)
+
+        self.assertEqual(Book.objects.count(), 29)
+        self.assertEqual(BookShelf.objects.count(), 58)
+
+    def test_dead_parsing_worker_aborts_the_import(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 30)])
+
+        # Exits without a traceback or sentinel, as if it had been killed
+        with mock.patch.multiple(import_books_command,
+                                 parse_shard=lambda *args: os._exit(1),
+                                 WORKER_POLL_SECONDS=0.1):
+            with self.assertRaisesMessage(CommandError, 'exited early'):
+                self.import_books(path, workers=2)
+
+    def test_chunks_sent_just_before_workers_exit_are_read(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 30)])
+        make_queue = multiprocessing.Queue
+
+        class LateQueue:
+            """Every wait times out just before the next item arrives."""
+
+            def __init__(self, maxsize):
+                self.queue = make_queue(maxsize)
+                self.put = self.queue.put
+                self.get_nowait = self.queue.get_nowait
+
+            def get(self, timeout):
+                time.sleep(timeout)
+                raise queue.Empty
+
+        with mock.patch.object(import_books_command, 'WORKER_POLL_SECONDS',
+                               0.1), \
+                mock.patch.object(multiprocessing, 'Queue', LateQueue):
+            self.import_books(path, workers=2, chunk_size=100)
+
+        self.assertEqual(Book.objects.count(), 29)
+
+    def test_limit_cannot_be_used_with_workers(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 8)])
+
+        with self.assertRaisesMessage(CommandError, '--limit'):
+            self.import_books(path, workers=2, limit=3)
+
+    def test_shard_ranges_align_to_lines(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 12)])
+
+        ranges = shard_ranges(path, 4)
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(path))
+        with open(path, 'rb') as file:
+            for begin, _ in ranges[1:]:
+                file.seek(begin - 1)
+                self.assertEqual(file.read(1), b'\n')
+
+    def test_checkpoint_is_written_after_each_chunk(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 6)])
+
+        self.import_books(path, chunk_size=2, limit=3)
+
+        with open(f'{path}.checkpoint') as file:
+            checkpoint = json.load(file)
+        with open(path, 'rb') as file:
+            expected_offset = sum(len(file.readline()) for _ in range(3))
+        stat = os.stat(path)
+        self.assertEqual(checkpoint, {
+            'offset': expected_offset, 'line': 3, 'chunk': 2,
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+        })
+
+    def test_resume_seeks_past_committed_lines(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 6)])
+        self.import_books(path, chunk_size=2, limit=2)
+        Book.objects.all().delete()
+
+        self.import_books(path, chunk_size=2, resume=True)
+
+        self.assertEqual(
+            sorted(Book.objects.values_list('dataset_api_id', flat=True)),
+            ['3', '4', '5'])
+
+    def test_resume_rejects_a_changed_file(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 6)])
+        self.import_books(path, chunk_size=2, limit=2)
+        with open(path, 'a') as file:
+            file.write(json.dumps(make_record(6)) + '\n')
+
+        with self.assertRaisesMessage(CommandError, 'another version'):
+            self.import_books(path, chunk_size=2, resume=True)
+
+    def test_unwritable_checkpoint_does_not_stop_the_import(self):
+        path = self.write_dataset([make_record(i) for i in range(1, 6)])
+        stderr = StringIO()
+
+        call_command('import_books', path, chunk_size=2, stdout=StringIO(),
+                     stderr=stderr,
+                     checkpoint=os.path.join(path, 'missing', 'checkpoint'))
+
+        self.assertEqual(Book.objects.count(), 5)
+        self.assertIn('Not writing checkpoints', stderr.getvalue())
+
+    def test_generated_catalog_imports(self):
+        path = self.write_dataset([])
+        call_command('generate_catalog', path, books=50, authors=10,
+                     shelves=40, shelves_per_book=8, seed=3, stdout=StringIO())
+
+        self.import_books(path, chunk_size=20)
+
+        self.assertEqual(Book.objects.count(), 50)
+        self.assertLessEqual(Author.objects.count(), 10)
+        self.assertTrue(Book.objects.exclude(series_id='').exists())
+        self.assertFalse(Book.objects.filter(top_shelves=None).exists())
+
+    def test_generated_ratings_are_consistent(self):
+        path = self.write_dataset([])
+        call_command('generate_catalog', path, books=2000, authors=10,
+                     shelves=40, shelves_per_book=2, seed=3, stdout=StringIO())
+
+        with open(path) as file:
+            records = [json.loads(line) for line in file]
+        for record in records:
+            *buckets, total = [int(part.partition(':')[2])
+                               for part in record['rating_dist'].split('|')]
+            self.assertEqual(sum(buckets), total)
+            self.assertEqual(int(record['ratings_count']), total)
+            if total:
+                self.assertGreaterEqual(float(record['average_rating']), 1)
+                self.assertLessEqual(float(record['average_rating']), 5)
+
+
+def make_author_record(api_id, **overrides):
+    record = {
+        'id': str(api_id),
+        'name': f'Author {api_id}',
+        'gender': 'female',
+        'image_url': '',
+        'about': f'About author {api_id}.',
+        'ratings_count': '120',
+        'average_rating': '3.876',
+        'text_reviews_count': '12',
+        'fans_count': '7',
+        'works_count': '2',
+        'work_ids': [str(api_id)],
+        'book_ids': [],
+    }
+    record.update(overrides)
+    return record
+
+
+class ImportAuthorsTests(ImportFileMixin, TestCase):
+    def import_authors(self, records, **options):
+        stdout = StringIO()
+        call_command('import_authors', self.write_dataset(records),
+                     stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def linked_api_ids(self, author_api_id):
+        return sorted(Book.objects.filter(authors__api_id=author_api_id)
+                      .values_list('dataset_api_id', flat=True))
+
+    def test_upserts_authors_in_chunks(self):
+        self.import_books(self.write_dataset([make_record(1)]))
+        Author.objects.filter(api_id='1').update(role='Editor')
+
+        self.import_authors(
+            [make_author_record(i, fans_count=str(i)) for i in range(1, 6)]
+            + [make_author_record(2, name='Renamed')],
+            chunk_size=2)
+
+        self.assertEqual(Author.objects.count(), 5)
+        author = Author.objects.get(api_id='1')
+        self.assertEqual(author.role, 'Editor')
+        self.assertEqual(author.fans_count, 1)
+        self.assertEqual(author.average_rating, Decimal('3.88'))
+        self.assertEqual(author.about, 'About author 1.')
+        self.assertEqual(author.work_ids, ['1'])
+        self.assertEqual(Author.objects.get(api_id='2').name, 'Renamed')
+
+    def test_adds_book_links_from_book_ids(self):
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 5)]))
+
+        output = self.import_authors([
+            make_author_record(1, book_ids=['1', '2', '404']),
+            make_author_record(9, book_ids=['3', 4]),
+        ])
+        # Book 1 was already linked to author 1 by the books dataset
+        self.assertIn('3 links to catalog books', output)
+        output = self.import_authors([make_author_record(1, book_ids=['2'])])
+        self.assertIn('0 links to catalog books', output)
+
+        # Links from the books dataset are kept
+        self.assertEqual(self.linked_api_ids('1'), ['1', '2', '4'])
+        self.assertEqual(self.linked_api_ids('9'), ['3', '4'])
+        self.assertEqual(Book.authors.through.objects.count(), 7)
+
+    def test_search_sees_imported_author_names(self):
+        self.import_books(self.write_dataset([make_record(1)]))
+
+        self.import_authors([make_author_record(
+            7, name='Ottoline Quibble', book_ids=['1'])])
+
+        response = self.client.get('/api/books/?search=quibble')
+        self.assertEqual(
+            [book['dataset_api_id'] for book in response.json()['results']],
+            ['1'])
+
+
+class CopyImportTests(ImportFileMixin, TestCase):
+    def snapshot(self):
+        return {
+            'books': list(Book.objects.order_by('dataset_api_id').values(
+                'dataset_api_id', 'title', 'average_rating', 'top_shelves')),
+            'authors': sorted(Book.authors.through.objects.values_list(
+                'book__dataset_api_id', 'author__api_id')),
+            'shelves': sorted(BookShelf.objects.values_list(
+                'book__dataset_api_id', 'shelf__name', 'count')),
+        }
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is PostgreSQL only')
+    def test_copy_matches_orm_import(self):
+        records = [make_record(i) for i in range(1, 8)] + [
+            make_record(3, title='Tab\tand\nnewline \\ backslash')]
+        path = self.write_dataset(records)
+        self.import_books(path, chunk_size=3)
+        expected = self.snapshot()
+        Book.objects.all().delete()
+        Author.objects.all().delete()
+
+        self.import_books(path, chunk_size=3, copy=True)
+
+        self.assertEqual(self.snapshot(), expected)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY is PostgreSQL only')
+    def test_copy_reimport_refreshes_columns_only(self):
+        self.import_books(self.write_dataset([make_record(1)]), copy=True)
+
+        self.import_books(self.write_dataset(
+            [make_record(1, title='Renamed')]), copy=True)
+
+        book = Book.objects.get()
+        self.assertEqual(book.title, 'Renamed')
+        self.assertEqual(book.authors.count(), 1)
+        self.assertEqual(BookShelf.objects.filter(book=book).count(), 2)
+
+    @skipUnless(connection.vendor != 'postgresql', 'COPY is available')
+    def test_copy_needs_postgresql(self):
+        with self.assertRaisesMessage(CommandError, 'PostgreSQL'):
+            self.import_books(self.write_dataset([make_record(1)]), copy=True)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+class SqlitePragmaTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            return get_pragma(cursor, name)
+
+    def test_connections_are_configured(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        # 2 is memory
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def test_bulk_load_restores_pragmas(self):
+        with bulk_load():
+            self.assertEqual(self.pragma('cache_size'), -256 * 1024)
+
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+
+    @override_settings(SQLITE_BULK_LOAD_PRAGMAS={'cache_size': '1; DROP'})
+    def test_pragma_values_are_validated(self):
+        with self.assertRaises(ImproperlyConfigured):
+            with bulk_load():
+                pass
+
+
+@override_settings(REPLICA_DATABASES=['replica_1', 'replica_2'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+
+    def read_in_request(self, model, method='get', user=None):
+        request = getattr(RequestFactory(), method)('/api/books/')
+        if user is not None:
+            request.user = user
+        databases = []
+
+        def view(request):
+            databases.append(self.router.db_for_read(model))
+            return HttpResponse()
+
+        ReplicaPinningMiddleware(view)(request)
+        return databases[0]
+
+    def test_catalog_reads_use_replicas(self):
+        self.assertIn(self.router.db_for_read(Book), ['replica_1', 'replica_2'])
+        self.assertIn(self.router.db_for_read(Book.authors.through),
+                      ['replica_1', 'replica_2'])
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+
+    def test_other_models_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Favorite), 'default')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_unsafe_requests_read_from_primary(self):
+        self.assertEqual(self.read_in_request(Book, 'post'), 'default')
+        self.assertIn(self.read_in_request(Book, 'get'),
+                      ['replica_1', 'replica_2'])
+
+    def test_users_read_their_writes(self):
+        user = User(pk=7)
+        self.assertNotEqual(self.read_in_request(Book, user=user), 'default')
+
+        pin_user(7)
+
+        self.assertEqual(self.read_in_request(Book, user=user), 'default')
+        self.assertNotEqual(self.read_in_request(Book, user=User(pk=8)),
+                            'default')
+
+    def test_pin_to_primary(self):
+        with pin_to_primary():
+            self.assertEqual(self.router.db_for_read(Book), 'default')
+        with pin_to_primary(False):
+            self.assertNotEqual(self.router.db_for_read(Book), 'default')
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+
+class ReplicaPinningTests(TestCase):
+    def test_favorite_writes_pin_the_user(self):
+        cache.clear()
+        user = User.objects.create_user('pinned')
+        cache.delete(pin_key(user.pk))
+        book = Book.objects.create(title='Book')
+
+        Favorite.objects.create(user=user, book=book)
+
+        self.assertTrue(is_user_pinned(user.pk))
+
+
+class BookApiTests(ImportFileMixin, TestCase):
+    def list_queries(self, url='/api/books/'):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.import_books(self.write_dataset([make_record(1)]))
+        single_page_queries, payload = self.list_queries()
+        self.assertEqual(len(payload['results']), 1)
+
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(2, 11)]))
+        full_page_queries, payload = self.list_queries()
+
+        self.assertEqual(len(payload['results']), 10)
+        self.assertEqual(single_page_queries, full_page_queries)
+
+    def test_shelves_are_ranked_and_limited(self):
+        shelves = [{'name': f'shelf-{i}', 'count': i} for i in range(30)]
+        self.import_books(self.write_dataset(
+            [make_record(1, shelves=shelves)]))
+        book = Book.objects.get()
+
+        response = self.client.get(f'/api/books/{book.id}/')
+
+        payload = response.json()
+        self.assertEqual(list(payload)[-1], 'shelves')
+        self.assertEqual(len(payload['shelves']), 20)
+        self.assertEqual(payload['shelves'][0], {'name': 'shelf-29', 'count': 29})
+        self.assertEqual(payload['shelves'][-1]['count'], 10)
+
+    def test_list_falls_back_to_batched_shelves_without_column(self):
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 11)]))
+        expected_queries, expected = self.list_queries()
+        # Bulk updates skip model signals, like the importer they bump the
+        # catalog version themselves
+        Book.objects.update(top_shelves=None)
+        bump_catalog_version()
+
+        queries, payload = self.list_queries()
+
+        self.assertEqual(queries, expected_queries + 1)
+        self.assertEqual(payload, expected)
+
+
+class TypedColumnTests(ImportFileMixin, TestCase):
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2006-09-16'), datetime.date(2006, 9, 16))
+        self.assertEqual(parse_date('2006-9'), datetime.date(2006, 9, 1))
+        self.assertEqual(parse_date('2006'), datetime.date(2006, 1, 1))
+        self.assertIsNone(parse_date('2006-02-30'))
+        self.assertIsNone(parse_date('unknown'))
+        self.assertIsNone(parse_date(None))
+
+    def test_parse_rating_dist(self):
+        self.assertEqual(parse_rating_dist('5:10|4:5|3:1|2:0|total:16'),
+                         {5: 10, 4: 5, 3: 1, 2: 0, 1: None})
+        self.assertEqual(parse_rating_dist(''), dict.fromkeys([5, 4, 3, 2, 1]))
+
+    def test_isbn_normalization(self):
+        self.assertEqual(isbn10_to_isbn13('0306406152'), '9780306406157')
+        self.assertEqual(lookup_isbn13('0-306-40615-2'), '9780306406157')
+        self.assertEqual(lookup_isbn13('978-0-306-40615-7'), '9780306406157')
+        self.assertEqual(lookup_isbn13('080442957x'), '9780804429573')
+        self.assertIsNone(lookup_isbn13('12345'))
+
+    def test_import_fills_typed_columns(self):
+        self.import_books(self.write_dataset([
+            make_record(1, isbn='0306406152', publication_date='1999-07'),
+            make_record(2, isbn='0306406152', isbn13='9781234567897',
+                        rating_dist='', publication_date='n/a'),
+        ]))
+
+        first = Book.objects.get(dataset_api_id='1')
+        self.assertEqual(first.published_date, datetime.date(1999, 7, 1))
+        self.assertEqual(first.original_published_date,
+                         datetime.date(2000, 1, 1))
+        self.assertEqual(
+            [first.rating_5_count, first.rating_4_count, first.rating_3_count,
+             first.rating_2_count, first.rating_1_count],
+            [10, 5, 1, 0, 0])
+        self.assertEqual(first.normalized_isbn10, '0306406152')
+        self.assertEqual(first.normalized_isbn13, '9780306406157')
+        second = Book.objects.get(dataset_api_id='2')
+        self.assertIsNone(second.published_date)
+        self.assertIsNone(second.rating_5_count)
+        self.assertEqual(second.normalized_isbn13, '9781234567897')
+
+    def list_ids(self, query):
+        response = self.client.get(f'/api/books/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(int(book['dataset_api_id'])
+                      for book in response.json()['results'])
+
+    def test_range_filters(self):
+        self.import_books(self.write_dataset([
+            make_record(i, publication_date=f'{2000 + i}-06-01',
+                        rating_dist=f'5:{i * 10}|4:5|3:1|2:0|1:{i}|total:1')
+            for i in range(1, 6)]))
+
+        self.assertEqual(self.list_ids('published_after=2003-01-01'),
+                         [3, 4, 5])
+        self.assertEqual(self.list_ids(
+            'published_after=2002-06-01&published_before=2004-06-01'),
+            [2, 3, 4])
+        self.assertEqual(self.list_ids('min_5_star=30'), [3, 4, 5])
+        self.assertEqual(self.list_ids('min_5_star=20&max_1_star=3'), [2, 3])
+        self.assertEqual(self.list_ids('original_published_before=1999-12-31'),
+                         [])
+
+    def test_invalid_range_filter(self):
+        response = self.client.get('/api/books/?published_after=June')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('published_after', response.json())
+
+    def test_lookup_by_isbn(self):
+        self.import_books(self.write_dataset([
+            make_record(1, isbn='0306406152'),
+            make_record(2, isbn13='9781234567897')]))
+
+        for isbn, api_id in [('0-306-40615-2', '1'), ('9780306406157', '1'),
+                             ('978-1-234-56789-7', '2')]:
+            response = self.client.get(f'/api/books/by-isbn/{isbn}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['dataset_api_id'], api_id)
+            self.assertEqual(len(response.json()['authors']), 1)
+
+        self.assertEqual(
+            self.client.get('/api/books/by-isbn/9780000000002/').status_code,
+            404)
+        self.assertEqual(
+            self.client.get('/api/books/by-isbn/123/').status_code, 404)
+
+
+class CatalogFilterTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset([
+            make_record(i, language=['eng', 'fre'][i % 2],
+                        series_id=f'series-{i % 3}',
+                        format=['Paperback', 'Hardcover'][i // 5],
+                        average_rating=str(3 + i / 10),
+                        ratings_count=str(100 - i))
+            for i in range(1, 10)]))
+
+    def list_ids(self, query):
+        response = self.client.get(f'/api/books/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [int(book['dataset_api_id'])
+                for book in response.json()['results']]
+
+    def test_exact_filters(self):
+        self.assertEqual(self.list_ids('language=fre'), [1, 3, 5, 7, 9])
+        self.assertEqual(self.list_ids('series_id=series-1'), [1, 4, 7])
+        self.assertEqual(self.list_ids('book_format=Hardcover'),
+                         [5, 6, 7, 8, 9])
+        # Authors are matched by their dataset id
+        self.assertEqual(self.list_ids('author=2'), [2, 5, 8])
+        self.assertEqual(self.list_ids('language=eng&author=2'), [2, 8])
+
+    def test_range_filters(self):
+        self.assertEqual(self.list_ids('min_rating=3.5&max_rating=3.75'),
+                         [5, 6, 7])
+        self.assertEqual(self.list_ids('min_ratings_count=95'),
+                         [1, 2, 3, 4, 5])
+        response = self.client.get('/api/books/?min_rating=high')
+        self.assertEqual(response.status_code, 400)
+
+    def test_orderings_apply_to_both_pagination_modes(self):
+        for ordering, expected in [('id', [2, 4, 6, 8]),
+                                   ('-average_rating', [8, 6, 4, 2]),
+                                   ('-ratings_count', [2, 4, 6, 8])]:
+            query = f'language=eng&ordering={ordering}'
+            self.assertEqual(self.list_ids(query), expected)
+            self.assertEqual(self.list_ids(f'{query}&paginate=cursor'),
+                             expected)
+        response = self.client.get('/api/books/?ordering=title')
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_number_ordering_keeps_null_values(self):
+        Book.objects.filter(dataset_api_id='2').update(average_rating=None)
+
+        self.assertEqual(
+            sorted(self.list_ids('language=eng&ordering=-average_rating')),
+            [2, 4, 6, 8])
+        self.assertEqual(self.list_ids(
+            'language=eng&ordering=-average_rating&paginate=cursor'),
+            [8, 6, 4])
+
+    def test_page_number_listing_is_ordered(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', UnorderedObjectListWarning)
+            self.assertEqual(self.client.get('/api/books/').status_code, 200)
+            self.assertEqual(self.client.get('/api/authors/').status_code,
+                             200)
+
+
+class ExportTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset([
+            make_record(i, title=f'Book, "{i}"') for i in range(1, 11)]))
+        Book.objects.filter(dataset_api_id='3').update(top_shelves=None)
+
+    def export_file(self, **options):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_books', path, stdout=StringIO(), **options)
+        with open(path, 'rb') as file:
+            return file.read()
+
+    def expected_payloads(self):
+        books = prefetch_book_relations(Book.objects.order_by('id'))
+        return json.loads(JSONRenderer().render(
+            BookSerializer(books, many=True).data))
+
+    def test_ndjson_matches_the_api_payloads(self):
+        data = self.export_file(batch_size=4)
+
+        lines = data.decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         self.expected_payloads())
+
+    def test_gzipped_csv(self):
+        data = gzip.decompress(self.export_file(format='csv', gzip=True))
+
+        rows = list(csv.DictReader(io.StringIO(data.decode())))
+        expected = self.expected_payloads()
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(set(rows[0]), set(expected[0]))
+        self.assertEqual(rows[0]['title'], 'Book, "1"')
+        self.assertEqual(json.loads(rows[2]['shelves']),
+                         expected[2]['shelves'])
+        self.assertEqual(json.loads(rows[0]['authors']),
+                         expected[0]['authors'])
+
+    def test_queries_grow_with_batches_not_books(self):
+        export = CatalogExport('ndjson', batch_size=4)
+
+        with CaptureQueriesContext(connection) as context:
+            list(export)
+
+        self.assertEqual(export.exported, 10)
+        # The book rows, then authors for each of the three batches and
+        # the ranked shelves of the batch with book 3
+        self.assertEqual(len(context.captured_queries), 1 + 3 + 1)
+
+    def test_endpoint_streams_for_authenticated_users(self):
+        self.assertEqual(
+            self.client.get('/api/books/export/ndjson/').status_code, 401)
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('analyst'))
+
+        response = api.get('/api/books/export/csv/?gzip=1&language=eng')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('books.csv.gz', response['Content-Disposition'])
+        data = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(len(data.decode().splitlines()), 11)
+        self.assertEqual(
+            api.get('/api/books/export/xml/').status_code, 404)
+
+    def test_endpoint_accepts_the_export_content_types(self):
+        api = APIClient()
+        self.assertEqual(api.get('/api/books/export/csv/',
+                                 HTTP_ACCEPT='text/csv').status_code, 401)
+        api.force_authenticate(User.objects.create_user('analyst'))
+
+        for url, accept in [
+                ('/api/books/export/csv/', 'text/csv'),
+                ('/api/books/export/ndjson/', 'application/x-ndjson'),
+                ('/api/books/export/ndjson/?gzip=1', 'application/gzip')]:
+            with self.subTest(accept=accept):
+                response = api.get(url, HTTP_ACCEPT=accept)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], accept)
+
+
+class ConditionalGetTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 4)]))
+        self.book = Book.objects.get(dataset_api_id='1')
+        self.url = f'/api/books/{self.book.id}/'
+
+    def test_matching_etag_returns_not_modified_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_rendered_body_is_cached(self):
+        first = self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+    def test_catalog_bump_from_another_process(self):
+        # The import commands bump the catalog from a process of their own
+        etag = self.client.get(self.url)['ETag']
+
+        run_in_new_process(
+            'from library.caching import bump_catalog_version; '
+            'bump_catalog_version()')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_saving_a_book_changes_only_its_etags(self):
+        other_url = f'/api/books/{Book.objects.get(dataset_api_id="2").id}/'
+        etag = self.client.get(self.url)['ETag']
+        other_etag = self.client.get(other_url)['ETag']
+        list_etag = self.client.get('/api/books/')['ETag']
+
+        self.book.title = 'Renamed'
+        self.book.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+        self.assertEqual(self.client.get(other_url)['ETag'], other_etag)
+        self.assertNotEqual(self.client.get('/api/books/')['ETag'], list_etag)
+
+    def test_deleting_an_author_changes_its_books_etags(self):
+        etag = self.client.get(self.url)['ETag']
+        list_etag = self.client.get('/api/books/')['ETag']
+        self.assertTrue(self.client.get(self.url).json()['authors'])
+
+        self.book.authors.get().delete()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['authors'], [])
+        self.assertNotEqual(self.client.get('/api/books/')['ETag'], list_etag)
+
+    def test_recent_changes_are_rendered_from_the_primary(self):
+        self.book.save()
+
+        with mock.patch('library.caching.pin_to_primary',
+                        wraps=pin_to_primary) as pin:
+            self.client.get(self.url)
+            pin.assert_called_once_with(True)
+
+            # Replicas have long caught up with these stamps
+            an_hour_ago = time.time_ns() - 3600 * 10 ** 9
+            cache.set(CATALOG_VERSION_KEY, an_hour_ago, None)
+            cache.set(object_version_key(Book, self.book.pk), an_hour_ago,
+                      None)
+            pin.reset_mock()
+            self.client.get(self.url)
+            pin.assert_called_once_with(False)
+
+    def test_import_changes_list_etag(self):
+        list_etag = self.client.get('/api/books/')['ETag']
+
+        self.import_books(self.write_dataset([make_record(4)]))
+
+        response = self.client.get('/api/books/', HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 4)
+
+    def test_query_string_is_part_of_the_etag(self):
+        first_page = self.client.get('/api/books/')['ETag']
+
+        self.assertNotEqual(
+            self.client.get('/api/books/', {'page': 1})['ETag'], first_page)
+
+
+class RowSerializationTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset([
+            make_record(1),
+            make_record(2, num_pages='', average_rating='',
+                        description='Line\u2028separator, caf\u00e9 "quoted"'),
+            make_record(3, authors=[
+                {'id': '7', 'name': 'Seven', 'role': ''},
+                {'id': '2', 'name': 'Author 2', 'role': 'Translator'},
+            ]),
+            make_record(4),
+        ]))
+        Book.objects.filter(dataset_api_id='4').update(top_shelves=None)
+        Author.objects.filter(api_id='7').update(
+            about='About', average_rating='4.25', work_ids=[1, 2])
+
+    def test_book_rows_match_serializer(self):
+        books = prefetch_book_relations(Book.objects.order_by('id'))
+        expected = JSONRenderer().render(BookSerializer(books, many=True).data)
+
+        row_serializer = BookRowSerializer(BookSerializer)
+        rows = list(row_serializer.values(Book.objects.order_by('id')))
+        actual = FastJSONRenderer().render(
+            row_serializer.to_representation(rows))
+
+        self.assertEqual(actual, expected)
+
+    def test_author_rows_match_serializer(self):
+        authors = Author.objects.order_by('id')
+        expected = JSONRenderer().render(
+            AuthorSerializer(authors, many=True).data)
+
+        row_serializer = RowSerializer(AuthorSerializer)
+        actual = FastJSONRenderer().render(row_serializer.to_representation(
+            list(row_serializer.values(authors))))
+
+        self.assertEqual(actual, expected)
+
+    def test_related_fields_need_add_related(self):
+        class AuthorRowSerializer(RowSerializer):
+            related_fields = ('books',)
+
+        with self.assertRaises(ImproperlyConfigured):
+            AuthorRowSerializer(AuthorSerializer)
+
+    def test_list_endpoint_uses_rows(self):
+        response = self.client.get('/api/books/')
+
+        books = prefetch_book_relations(Book.objects.order_by('id'))
+        self.assertEqual(response.json()['results'],
+                         json.loads(JSONRenderer().render(
+                             BookSerializer(books, many=True).data)))
+
+    def test_renderer_falls_back_for_indented_output(self):
+        data = {'title': 'Caf\u00e9'}
+
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=2'),
+            JSONRenderer().render(data, 'application/json; indent=2'))
+
+
+class SparseFieldsetTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 13)]))
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in queries]
+
+    def test_list_selects_only_requested_columns(self):
+        response, queries = self.get('/api/books/', fields='title,average_rating')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['results'][0]),
+                         ['title', 'average_rating'])
+        # The count and the page, no author or shelf lookups
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('description', queries[1])
+        self.assertNotIn('top_shelves', queries[1])
+
+    def test_retrieve_exclude_skips_columns_and_relations(self):
+        book = Book.objects.get(dataset_api_id='1')
+
+        response, queries = self.get(f'/api/books/{book.id}/',
+                                     exclude='description,shelves,authors')
+
+        payload = response.json()
+        self.assertEqual(payload['title'], 'Book 1')
+        self.assertFalse({'description', 'shelves', 'authors'} & set(payload))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0])
+
+    def test_fields_and_exclude_combine(self):
+        response, _ = self.get('/api/books/', fields='id,title,shelves',
+                               exclude='id')
+
+        result = response.json()['results'][0]
+        self.assertEqual(list(result), ['title', 'shelves'])
+        self.assertEqual(result['shelves'][0], {'name': 'to-read', 'count': 11})
+
+    def test_cursor_pages_with_sparse_fields(self):
+        response, _ = self.get('/api/books/', fields='title', paginate='cursor',
+                               ordering='-average_rating')
+        next_page = self.client.get(response.json()['next'])
+
+        self.assertEqual(next_page.status_code, 200)
+        self.assertEqual(list(next_page.json()['results'][0]), ['title'])
+        self.assertEqual(len(response.json()['results'])
+                         + len(next_page.json()['results']), 12)
+
+    def test_author_fields(self):
+        response, queries = self.get('/api/authors/', fields='name')
+
+        self.assertEqual(response.json()['results'][0], {'name': 'Author 1'})
+        self.assertNotIn('work_ids', queries[-1])
+
+    def test_unknown_field_is_rejected(self):
+        response, _ = self.get('/api/books/', fields='title,nope')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('nope', response.json()['fields'][0])
+
+
+@override_settings(REQUEST_PROFILING=True,
+                   REQUEST_PROFILING_DUPLICATE_THRESHOLD=3)
+class ProfilingTests(ImportFileMixin, TestCase):
+    def test_server_timing_header_and_log_line(self):
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 4)]))
+
+        with self.assertLogs('library.profiling', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/books/')
+
+        metrics = [metric.split(';')[0]
+                   for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, ['sql', 'sql-slowest', 'serialize',
+                                   'render', 'total'])
+        self.assertIn(f'desc="{len(queries)} queries"',
+                      response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], '/api/books/')
+        self.assertEqual(record['query_count'], len(queries))
+        self.assertEqual(len(record['slowest_queries']), 3)
+        self.assertEqual(record['duplicate_queries'], [])
+
+    def test_repeated_statements_are_flagged(self):
+        def view(request):
+            for book_id in range(4):
+                Book.objects.filter(id=book_id).first()
+            return HttpResponse()
+        middleware = ProfilingMiddleware(view)
+
+        with self.assertLogs('library.profiling', 'INFO') as logs:
+            middleware(RequestFactory().get('/api/books/'))
+
+        self.assertEqual(logs.records[1].levelname, 'WARNING')
+        duplicates = json.loads(logs.records[0].getMessage())[
+            'duplicate_queries']
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(duplicates[0]['count'], 4)
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled_without_setting(self):
+        response = self.client.get('/api/books/')
+
+        self.assertNotIn('Server-Timing', response)
+
+
+class TopShelvesTests(ImportFileMixin, TestCase):
+    def test_import_fills_top_shelves(self):
+        shelves = [{'name': f'shelf-{i}', 'count': i} for i in range(25)]
+        self.import_books(self.write_dataset(
+            [make_record(1, shelves=shelves)]))
+
+        top_shelves = Book.objects.get().top_shelves
+
+        self.assertEqual(len(top_shelves), 20)
+        self.assertEqual(top_shelves[0], ['shelf-24', 24])
+        self.assertEqual(top_shelves[-1], ['shelf-5', 5])
+
+    def test_rebuild_matches_import(self):
+        self.import_books(self.write_dataset(
+            [make_record(i) for i in range(1, 6)]))
+        imported = dict(Book.objects.values_list('id', 'top_shelves'))
+        Book.objects.update(top_shelves=None)
+
+        call_command('rebuild_top_shelves', batch_size=2, missing_only=True,
+                     stdout=StringIO())
+
+        self.assertEqual(
+            dict(Book.objects.values_list('id', 'top_shelves')), imported)
+
+
+class SearchTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset([
+            make_record(1, title='The Hobbit', description='Dragons.'),
+            make_record(2, title='Dune', description='A hobbit cameo.',
+                        authors=[{'id': '9', 'name': 'Frank Herbert'}]),
+            make_record(3, title='Emma'),
+        ]))
+
+    def search(self, term):
+        response = self.client.get('/api/books/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return [book['title'] for book in response.json()['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(self.search('hobbit'), ['The Hobbit', 'Dune'])
+
+    def test_relevance_order_is_kept_over_id_order(self):
+        self.import_books(self.write_dataset([
+            make_record(4, title='Orchard', description=(
+                'A long story about farming in which an apple appears '
+                'exactly once among many other words.')),
+            make_record(5, title='Apple Apple', description='Apple.'),
+        ]))
+
+        self.assertEqual(self.search('apple'), ['Apple Apple', 'Orchard'])
+        response = self.client.get(
+            '/api/books/', {'search': 'apple', 'ordering': 'id'})
+        self.assertEqual([book['title'] for book in response.json()['results']],
+                         ['Orchard', 'Apple Apple'])
+
+    def test_matches_author_names_and_prefixes(self):
+        self.assertEqual(self.search('herb'), ['Dune'])
+
+    def test_terms_are_combined_and_quoted(self):
+        self.assertEqual(self.search('hobbit dragons'), ['The Hobbit'])
+        self.assertEqual(self.search('"hobbit OR'), [])
+
+    def test_orm_writes_refresh_index(self):
+        book = Book.objects.create(title='Zanzibar')
+        self.assertEqual(self.search('zanzibar'), ['Zanzibar'])
+
+        book.title = 'Zambezi'
+        book.save()
+        self.assertEqual(self.search('zanzibar'), [])
+        author = Author.objects.create(name='Quentin Blake')
+        book.authors.add(author)
+        self.assertEqual(self.search('quentin'), ['Zambezi'])
+        author.name = 'Roald Dahl'
+        author.save()
+        self.assertEqual(self.search('quentin'), [])
+        self.assertEqual(self.search('dahl'), ['Zambezi'])
+        author.books.clear()
+        self.assertEqual(self.search('dahl'), [])
+        book.authors.add(author)
+        self.assertEqual(self.search('dahl'), ['Zambezi'])
+        author.delete()
+        self.assertEqual(self.search('dahl'), [])
+
+        book.delete()
+        self.assertEqual(self.search('zambezi'), [])
+
+    def test_reimport_refreshes_index(self):
+        self.import_books(self.write_dataset(
+            [make_record(3, title='Persuasion')]))
+
+        self.assertEqual(self.search('emma'), [])
+        self.assertEqual(self.search('persuasion'), ['Persuasion'])
+
+
+class CursorPaginationTests(ImportFileMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Ratings repeat so the ranked ordering has ties to break on id
+        self.import_books(self.write_dataset([
+            make_record(i, average_rating=str(3 + i % 3)) for i in range(1, 26)
+        ]))
+
+    def walk(self, url):
+        titles, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            queries.extend(query['sql'] for query in context.captured_queries)
+            payload = response.json()
+            self.assertNotIn('count', payload)
+            titles.extend(book['title'] for book in payload['results'])
+            url = payload['next']
+        return titles, queries
+
+    def test_walks_catalog_by_id_without_counting(self):
+        titles, queries = self.walk('/api/books/?paginate=cursor')
+
+        expected = list(Book.objects.order_by('id').values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+        self.assertFalse(any('COUNT(' in sql for sql in queries))
+        self.assertFalse(any('OFFSET' in sql for sql in queries))
+
+    def test_walks_ranked_catalog(self):
+        titles, _ = self.walk('/api/books/?paginate=cursor&ordering=-average_rating')
+
+        expected = list(Book.objects.order_by('-average_rating', 'id')
+                        .values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+
+    def test_previous_link_returns_same_page(self):
+        first = self.client.get('/api/books/?paginate=cursor').json()
+        second = self.client.get(first['next']).json()
+
+        previous = self.client.get(second['previous']).json()
+
+        self.assertEqual(previous['results'], first['results'])
+
+    def test_page_number_pagination_is_still_the_default(self):
+        payload = self.client.get('/api/authors/').json()
+
+        self.assertEqual(payload['count'], 3)
+
+    def test_invalid_cursor_and_ordering(self):
+        response = self.client.get('/api/books/?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get('/api/books/?paginate=cursor&ordering=title')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_values_of_the_wrong_type(self):
+        for ordering, position in [('id', ['abc']), ('id', [None]),
+                                   ('id', [[1]]),
+                                   ('-average_rating', ['high', 3]),
+                                   ('-average_rating', [None, 3])]:
+            cursor = base64.urlsafe_b64encode(
+                json.dumps({'p': position, 'r': 0}).encode()).decode()
+            with self.subTest(ordering=ordering, position=position):
+                response = self.client.get(
+                    '/api/books/', {'ordering': ordering, 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+def shelf_record(api_id, author, shelves, **overrides):
+    overrides.setdefault('series_id', f'series-{api_id}')
+    return make_record(
+        api_id, author_id=author,
+        authors=[{'id': author, 'name': f'Author {author}'}],
+        shelves=[{'name': name, 'count': count} for name, count in shelves],
+        **overrides)
+
+
+class RecommendationDataMixin(ImportFileMixin):
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset([
+            shelf_record(1, 'a', [('fantasy', 50), ('dragons', 40)]),
+            shelf_record(2, 'b', [('fantasy', 30), ('dragons', 30)],
+                         average_rating='3.5'),
+            shelf_record(3, 'c', [('fantasy', 5), ('dragons', 5),
+                                  ('romance', 90)],
+                         average_rating='4.9'),
+            shelf_record(4, 'a', [('romance', 10)], average_rating='3.0'),
+            shelf_record(5, 'd', [('history', 10)], series_id='s1'),
+            shelf_record(6, 'e', [('history', 10)], series_id='s1',
+                         language='fre'),
+            shelf_record(7, 'f', [('cooking', 10)]),
+        ]))
+        self.user = User.objects.create_user('reader', password='secret')
+
+    def favorite(self, *api_ids):
+        for api_id in api_ids:
+            Favorite.objects.create(
+                user=self.user, book=Book.objects.get(dataset_api_id=api_id))
+
+
+class RecommendationTests(RecommendationDataMixin, TestCase):
+    def recommended(self):
+        return [book.dataset_api_id for book in recommend_books(self.user)]
+
+    def test_computed_on_primary_with_replicas(self):
+        self.favorite('1', '5')
+
+        # replica_1 isn't configured, a query routed to it would raise
+        with mock.patch.object(ReplicaRouter, 'db_for_read',
+                               return_value='replica_1'):
+            self.assertEqual(self.recommended(), ['4', '3', '2'])
+
+    def test_recommends_by_author_series_and_shelves(self):
+        self.favorite('1', '5')
+
+        # Book 6 shares the series but not the language, books 2 and 3 tie
+        # on shelves and are ordered by rating
+        self.assertEqual(self.recommended(), ['4', '3', '2'])
+
+    def test_neighbor_model_drives_shelf_recommendations(self):
+        self.favorite('1')
+        call_command('build_book_neighbors', max_df=1.0, stdout=StringIO())
+
+        neighbors = BookNeighbor.objects.filter(
+            book__dataset_api_id='1').order_by('rank')
+        self.assertEqual(
+            [neighbor.neighbor.dataset_api_id for neighbor in neighbors],
+            ['2', '3'])
+        # The closest neighbor now wins over the better rated book
+        self.assertEqual(self.recommended(), ['4', '2', '3'])
+
+    def test_favorites_without_neighbors_fall_back_to_shelves(self):
+        self.favorite('1', '5')
+        call_command('build_book_neighbors', max_df=1.0, stdout=StringIO())
+        # As if the model had only been built for some books so far
+        BookNeighbor.objects.filter(
+            book__dataset_api_id__in=['1', '5']).delete()
+        self.assertTrue(BookNeighbor.objects.exists())
+
+        self.assertEqual(self.recommended(), ['4', '3', '2'])
+
+
+@override_settings(RECOMMENDATIONS_ASYNC=False)
+class FavoriteApiTests(RecommendationDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def add_favorite(self, api_id):
+        book = Book.objects.get(dataset_api_id=api_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post('/api/favorites/', {'book': book.id})
+
+    def test_create_returns_before_recommendations_are_computed(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.api.post(
+                '/api/favorites/',
+                {'book': Book.objects.get(dataset_api_id='1').id})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recommendations_status'], 'pending')
+        self.assertNotIn('recommendations', response.data)
+        self.assertEqual(len(callbacks), 1)
+        status = self.api.get('/api/favorites/recommendations/').data['status']
+        self.assertEqual(status, 'pending')
+
+    def test_recommendations_endpoint_serves_latest_result(self):
+        self.add_favorite('1')
+        self.add_favorite('5')
+
+        response = self.api.get('/api/favorites/recommendations/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'ready')
+        self.assertIsNotNone(response.data['computed_at'])
+        self.assertEqual(
+            [book['dataset_api_id'] for book in response.data['recommendations']],
+            ['4', '3', '2'])
+
+    def test_removing_a_favorite_recomputes(self):
+        self.add_favorite('1')
+        favorite = Favorite.objects.get()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api.delete(f'/api/favorites/{favorite.id}/')
+
+        response = self.api.get('/api/favorites/recommendations/')
+        self.assertEqual(response.data['status'], 'ready')
+        self.assertEqual(response.data['recommendations'], [])
+
+
+@override_settings(RECOMMENDATIONS_ASYNC=False)
+class BulkFavoriteTests(RecommendationDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.book_ids = dict(Book.objects.values_list('dataset_api_id', 'id'))
+
+    def bulk(self, add=(), remove=()):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.api.post(
+                '/api/favorites/bulk/',
+                {'add': [self.book_ids.get(api_id, 404) for api_id in add],
+                 'remove': [self.book_ids.get(api_id, 404)
+                            for api_id in remove]},
+                format='json')
+        self.callbacks = callbacks
+        return response
+
+    def favorite_api_ids(self):
+        return sorted(Favorite.objects.filter(user=self.user)
+                      .values_list('book__dataset_api_id', flat=True))
+
+    def statuses(self, response):
+        return [(item['action'], item['status'])
+                for item in response.data['results']]
+
+    def test_adds_and_removes_with_a_status_per_book(self):
+        self.favorite('1', '2')
+
+        response = self.bulk(add=['3', '1', 'missing', '3'],
+                             remove=['2', '4'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(response), [
+            ('add', 'added'), ('add', 'exists'), ('add', 'not_found'),
+            ('remove', 'removed'), ('remove', 'not_found')])
+        self.assertEqual(self.favorite_api_ids(), ['1', '3'])
+        self.assertEqual(response.data['recommendations_status'], 'pending')
+
+    def test_recommendations_are_computed_once(self):
+        self.bulk(add=['1', '5'])
+
+        self.assertEqual(len(self.callbacks), 1)
+        recommendations = self.api.get('/api/favorites/recommendations/').data
+        self.assertEqual(recommendations['status'], 'ready')
+        self.assertEqual(
+            [book['dataset_api_id']
+             for book in recommendations['recommendations']],
+            ['4', '3', '2'])
+
+    def test_invalidates_cached_recommendations(self):
+        # Favorites added with bulk_create send no signals
+        key = recommendation_cache_key(self.user.id, 5)
+        cache.delete(pin_key(self.user.id))
+
+        self.bulk(add=['5'])
+
+        self.assertNotEqual(recommendation_cache_key(self.user.id, 5), key)
+        self.assertTrue(is_user_pinned(self.user.id))
+
+    def test_limit_is_checked_for_the_whole_request(self):
+        extra = [make_record(i) for i in range(100, 115)]
+        self.import_books(self.write_dataset(extra))
+        self.book_ids = dict(Book.objects.values_list('dataset_api_id', 'id'))
+        self.favorite(*[str(i) for i in range(100, 110)])
+
+        add = [str(i) for i in range(110, 115)] + ['1', '2', '3', '4', '5',
+                                                   '6']
+
+        response = self.bulk(add=add)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.favorite_api_ids()), 10)
+        self.assertEqual(self.callbacks, [])
+
+        # Removals in the same request make room
+        response = self.bulk(add=add, remove=['100'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.favorite_api_ids()), 20)
+
+    def test_rejects_conflicting_and_empty_requests(self):
+        self.assertEqual(self.bulk(add=['1'], remove=['1']).status_code, 400)
+        self.assertEqual(self.bulk().status_code, 400)
+
+    def test_rejects_ids_out_of_range(self):
+        for ids in ([10 ** 20], [0], [-1]):
+            with self.subTest(ids=ids):
+                for name in ('add', 'remove'):
+                    response = self.api.post('/api/favorites/bulk/',
+                                             {name: ids}, format='json')
+
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(name, response.data)
+
+
+class RecommendationCacheTests(RecommendationDataMixin, TestCase):
+    def recommended(self):
+        return [book.dataset_api_id
+                for book in cached_recommend_books(self.user)]
+
+    def test_repeated_calls_hit_the_cache(self):
+        self.favorite('1', '5')
+
+        first = self.recommended()
+        with CaptureQueriesContext(connection) as context:
+            second = self.recommended()
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(recommendation_cache_stats(),
+                         {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_invalidation_and_stats_are_shared_across_processes(self):
+        self.favorite('1', '5')
+        self.recommended()
+
+        # As import_books does from its own process
+        run_in_new_process(
+            'from library.caching import bump_catalog_version; '
+            'bump_catalog_version()')
+        self.recommended()
+        run_in_new_process(
+            'from library.caching import RECOMMENDATION_HITS_KEY, increment; '
+            'increment(RECOMMENDATION_HITS_KEY)')
+
+        self.assertEqual(recommendation_cache_stats(),
+                         {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3})
+
+    def test_favorite_changes_invalidate(self):
+        self.favorite('1')
+        self.assertEqual(self.recommended(), ['4', '3', '2'])
+
+        Favorite.objects.filter(book__dataset_api_id='1').delete()
+
+        self.assertEqual(self.recommended(), [])
+        self.assertEqual(recommendation_cache_stats()['misses'], 2)
+
+    def test_catalog_import_invalidates(self):
+        self.favorite('1')
+        self.recommended()
+
+        self.import_books(self.write_dataset([
+            shelf_record(8, 'g', [('fantasy', 80), ('dragons', 80)],
+                         average_rating='5.0')]))
+
+        self.assertEqual(self.recommended()[:2], ['4', '8'])
+
+    def test_stats_endpoint_is_admin_only(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(
+            api.get('/api/favorites/recommendations/cache-stats/').status_code,
+            403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = api.get('/api/favorites/recommendations/cache-stats/')
+        self.assertEqual(response.data, {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+
+class QueryPlanMixin:
+    def full_scans(self, queries):
+        """
+        Tables read without an index by the captured SELECT queries, as
+        reported by SQLite's EXPLAIN QUERY PLAN.
+        """
+        tables = set(connection.introspection.table_names())
+        scans = []
+        for query in queries:
+            sql = query['sql']
+            if not re.match(r'\s*(WITH|SELECT)', sql, re.IGNORECASE):
+                continue
+            # Plans name tables by their alias (U0, b...) when they have one
+            aliases = {
+                alias for table, alias in re.findall(
+                    r'(?:FROM|JOIN)\s+"?(\w+)"?\s+(?:AS\s+)?"?(\w+)"?', sql)
+                if table in tables
+            }
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for *_, detail in cursor.fetchall():
+                    match = re.fullmatch(r'SCAN (\S+)', detail)
+                    if match and match[1] in tables | aliases:
+                        scans.append((detail, sql))
+        return scans
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def assertNoFullScans(self, queries):
+        queries = list(queries)
+        self.assertTrue(queries)
+        self.assertEqual(self.full_scans(queries), [])
+
+
+@skipUnless(connection.vendor == 'sqlite',
+            'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(QueryPlanMixin, RecommendationDataMixin, TestCase):
+    """Recommendation, shelf and listing queries must all use indexes."""
+
+    def setUp(self):
+        super().setUp()
+        self.import_books(self.write_dataset(
+            [make_record(i, average_rating=str(3 + i % 7 / 3),
+                         language=['eng', 'fre', 'ger'][i % 3],
+                         series_id=f'series-{i % 4}')
+             for i in range(100, 140)]))
+        self.favorite('1', '5')
+
+    def capture(self, function, *args):
+        with CaptureQueriesContext(connection) as context:
+            function(*args)
+        return context.captured_queries
+
+    def test_recommendation_queries(self):
+        self.assertNoFullScans(self.capture(recommend_books, self.user))
+
+    def test_neighbor_recommendation_queries(self):
+        call_command('build_book_neighbors', max_df=1.0, stdout=StringIO())
+
+        self.assertNoFullScans(self.capture(recommend_books, self.user))
+
+    def test_shelf_queries(self):
+        Book.objects.update(top_shelves=None)
+
+        queries = self.capture(self.client.get, '/api/books/?search=book')
+
+        self.assertNoFullScans(
+            query for query in queries if 'library_bookshelf' in query['sql'])
+
+    def test_keyset_listing_queries(self):
+        for ordering in ('id', '-average_rating'):
+            url = f'/api/books/?paginate=cursor&ordering={ordering}'
+            next_page = self.client.get(url).json()['next']
+
+            queries = self.capture(self.client.get, next_page)
+
+            self.assertNoFullScans(queries)
+
+    def filtered_listing_queries(self, query, ordering):
+        url = f'/api/books/?{query}&ordering={ordering}'
+        queries = self.capture(self.client.get, url)
+        next_page = self.client.get(f'{url}&paginate=cursor').json()['next']
+        self.assertTrue(next_page)
+        return queries + self.capture(self.client.get, next_page)
+
+    def filter_queries(self):
+        """A query string matching every test book for each filter."""
+        values = {'language': 'eng', 'series_id': 'series-1',
+                  'book_format': 'Paperback', 'author': '1'}
+        exact = [f'{param}={values[param]}'
+                 for param in BookViewSet.exact_filters]
+        ranges = []
+        for param, (_, lookup, parse) in BookViewSet.range_filters.items():
+            if parse == datetime.date.fromisoformat:
+                value = '1900-01-01' if lookup == 'gte' else '2100-01-01'
+            else:
+                value = '0' if lookup == 'gte' else '1000'
+            ranges.append(f'{param}={value}')
+        return exact, ranges
+
+    def assertPrimaryKeyWalks(self, queries):
+        # No index serves a range on one column in order of another; the
+        # accepted plan walks the table in id order and stops after a page.
+        # The page count has no LIMIT and still needs the filter's index
+        for detail, sql in self.full_scans(queries):
+            self.assertRegex(sql, r'ORDER BY .* LIMIT \d+$')
+            self.assertNotIn('TEMP B-TREE', self.plan(sql))
+
+    def test_filtered_listing_queries(self):
+        exact, ranges = self.filter_queries()
+        for ordering in KeysetPagination.orderings:
+            for query in exact + [f'{exact[0]}&{query}' for query in ranges]:
+                with self.subTest(query=query, ordering=ordering):
+                    self.assertNoFullScans(
+                        self.filtered_listing_queries(query, ordering))
+            for query in ranges:
+                with self.subTest(query=query, ordering=ordering):
+                    queries = self.filtered_listing_queries(query, ordering)
+                    if ordering == 'id':
+                        self.assertPrimaryKeyWalks(queries)
+                    else:
+                        self.assertNoFullScans(queries)
+
+    def test_isbn_lookup_queries(self):
+        queries = self.capture(
+            self.client.get, '/api/books/by-isbn/9780306406157/')
+
+        self.assertNoFullScans(queries)
+
+
+def reference_recommend_books(user, limit=5):
+    """
+    recommend_books as it was written with one ORM query per source, with
+    ties among the popular shelves broken by id and popular shelves used
+    when the neighbor model has no candidates.
+    """
+    favorite_book_ids = list(
+        Favorite.objects.filter(user=user).values_list('book', flat=True))
+    favorite_books_query = Book.objects.filter(id__in=favorite_book_ids)
+    favorite_authors_id = favorite_books_query.values_list(
+        'author_id', flat=True).distinct()
+    favorite_series_ids = favorite_books_query.values_list(
+        'series_id', flat=True).distinct()
+    favorite_languages = favorite_books_query.values_list(
+        'language', flat=True).distinct()
+
+    recommendations_by_author = Book.objects.filter(
+        author_id__in=favorite_authors_id
+    ).exclude(id__in=favorite_book_ids).filter(
+        language__in=favorite_languages
+    ).order_by('-average_rating', '-ratings_count')[:1]
+    recommendations_by_series = Book.objects.filter(
+        series_id__in=favorite_series_ids
+    ).exclude(id__in=favorite_book_ids).filter(
+        language__in=favorite_languages
+    ).order_by('-average_rating', '-ratings_count')[:1]
+
+    recommendations_by_shelves = list(
+        Book.objects.filter(neighbor_of__book__in=favorite_book_ids)
+        .exclude(id__in=favorite_book_ids)
+        .exclude(author_id__in=favorite_authors_id)
+        .filter(language__in=favorite_languages)
+        .annotate(similarity=Sum('neighbor_of__score'))
+        .order_by('-similarity', '-average_rating', '-ratings_count')[:20])
+    if not recommendations_by_shelves:
+        popular_shelves = (
+            Shelf.objects.filter(bookshelf__book__in=favorite_book_ids)
+            .annotate(count=Count('bookshelf'))
+            .order_by('-count', 'id')
+            .values_list('id', flat=True)
+        )[:20]
+        recommendations_by_shelves = (
+            Book.objects.filter(bookshelf__shelf__in=popular_shelves)
+            .exclude(id__in=favorite_book_ids)
+            .exclude(author_id__in=favorite_authors_id)
+            .filter(language__in=favorite_languages)
+            .annotate(shelf_popularity=Coalesce(
+                Count('bookshelf',
+                      filter=Q(bookshelf__shelf__in=popular_shelves)),
+                Value(0)))
+            .order_by('-shelf_popularity', '-average_rating', '-ratings_count')
+        )[:20]
+
+    seen_authors = set()
+    unique_recommendations_by_shelves = []
+    for book in recommendations_by_shelves:
+        if book.author_id not in seen_authors:
+            seen_authors.add(book.author_id)
+            unique_recommendations_by_shelves.append(book)
+        if len(unique_recommendations_by_shelves) >= limit:
+            break
+
+    recommendations = list(recommendations_by_author) + \
+        list(recommendations_by_series) + \
+        list(unique_recommendations_by_shelves)
+    return list({book.id: book for book in recommendations}.values())[:limit]
+
+
+class RecommendationQueryDifferentialTests(ImportFileMixin, TestCase):
+    """The single-statement recommend_books matches the ORM version."""
+
+    def setUp(self):
+        super().setUp()
+        generator = random.Random(20240818)
+        # More shelves among a few favorites than the 20 popular ones
+        # considered, with tied counts at the cut
+        shelves = [f'shelf-{i}' for i in range(60)]
+        self.import_books(self.write_dataset([
+            make_record(
+                i,
+                author_id=str(generator.randrange(12)),
+                series_id=generator.choice(['', '', 's1', 's2', 's3', 's4']),
+                language=generator.choice(['eng', 'eng', 'fre', 'ger']),
+                average_rating=str(round(generator.uniform(2, 5), 2)),
+                # Unique counts make every ordering total
+                ratings_count=str(1000 + i),
+                shelves=[{'name': name, 'count': generator.randrange(1, 500)}
+                         for name in generator.sample(shelves, 8)],
+            )
+            for i in range(150)
+        ]))
+        self.book_ids = list(Book.objects.values_list('id', flat=True))
+        self.generator = generator
+
+    def assertMatchesReference(self, trials):
+        for trial in range(trials):
+            user = User.objects.create_user(f'reader-{trial}')
+            for book_id in self.generator.sample(
+                    self.book_ids, self.generator.randint(0, 6)):
+                Favorite.objects.create(user=user, book_id=book_id)
+
+            with self.subTest(trial=trial):
+                self.assertEqual(
+                    [book.id for book in recommend_books(user)],
+                    [book.id for book in reference_recommend_books(user)])
+
+    def test_popular_shelves_path(self):
+        self.assertMatchesReference(40)
+
+    def test_popular_shelves_tied_at_the_limit(self):
+        user = User.objects.create_user('reader')
+        for book_id in self.book_ids[:5]:
+            Favorite.objects.create(user=user, book_id=book_id)
+        counts = sorted(BookShelf.objects.filter(
+            book_id__in=self.book_ids[:5]).values('shelf')
+            .annotate(books=Count('book')).values_list('books', flat=True),
+            reverse=True)
+        self.assertGreater(len(counts), 20)
+        self.assertEqual(counts[19], counts[20])
+
+        self.assertEqual(
+            [book.id for book in recommend_books(user)],
+            [book.id for book in reference_recommend_books(user)])
+
+    def test_neighbor_path(self):
+        call_command('build_book_neighbors', max_df=1.0, stdout=StringIO())
+
+        self.assertMatchesReference(40)
+
+    def test_partial_neighbor_path(self):
+        call_command('build_book_neighbors', max_df=1.0, stdout=StringIO())
+        BookNeighbor.objects.filter(book_id__in=self.book_ids[::2]).delete()
+
+        self.assertMatchesReference(40)
+
+    def test_recommendations_take_one_query(self):
+        user = User.objects.create_user('reader')
+        Favorite.objects.create(user=user, book_id=self.book_ids[0])
+
+        with self.assertNumQueries(1):
+            recommend_books(user)
@@ -1,87 +1,113 @@
+from collections import defaultdict
 from typing import List
-from django.db.models import Count, Q, Value
-from typing import List
-from library.models import Book, Shelf, Favorite
-from django.db.models.functions import Coalesce
-
-
-def recommend_books(user, limit: int = 5) -> List[Book]:
-    # Get all favorite books for the user
-    favorite_books = Favorite.objects.filter(user=user).values('book')
-    favorite_book_ids = [book['book'] for book in favorite_books]
-    favorite_books_query = Book.objects.filter(id__in=favorite_book_ids)
-
-    # Extract favorite authors, series_ids, and languages
-    favorite_authors_id = favorite_books_query.values_list(
-        'author_id', flat=True).distinct()
-    favorite_series_ids = favorite_books_query.values_list(
-        'series_id', flat=True).distinct()
-    favorite_languages = favorite_books_query.values_list(
-        'language', flat=True).distinct()
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from library.models import Book, BookShelf, TOP_SHELVES_LIMIT
+from library.routers import PRIMARY
 
-    # Popular shelves
-    popular_shelves = (
-        Shelf.objects.filter(
-            bookshelf__book__in=favorite_book_ids
-        )
-        .annotate(count=Count('bookshelf'))
-        .order_by('-count')
-        .values_list('id', flat=True)
-    )[:20]
+# Candidate sources, in the order their books are recommended
+BY_AUTHOR, BY_SERIES, BY_SHELVES = 1, 2, 3
 
-    # Recommendations by author
-    recommendations_by_author = Book.objects.filter(
-        author_id__in=favorite_authors_id
-    ).exclude(
-        id__in=favorite_book_ids
-    ).filter(
-        language__in=favorite_languages
-    ).order_by(
-        '-average_rating',
-        '-ratings_count'
-    )[:1]  # Get 1 recommendation based on authors
+# Every candidate list is computed in one statement. Shelf candidates come
+# from the offline neighbor model, and from the shelves most common among
+# the favorites when the model has no candidates for them: while it is
+# being built, or for books imported since, say.
+RECOMMENDATION_SQL = """
+WITH favorite AS (
+    SELECT book_id FROM library_favorite WHERE user_id = %(user_id)s
+),
+favorite_book AS (
+    SELECT author_id, series_id, language
+    FROM library_book
+    WHERE id IN (SELECT book_id FROM favorite)
+),
+popular_shelf AS (
+    SELECT shelf_id
+    FROM library_bookshelf
+    WHERE book_id IN (SELECT book_id FROM favorite)
+    GROUP BY shelf_id
+    -- Shelves tied at the limit are taken in id order
+    ORDER BY COUNT(*) DESC, shelf_id
+    LIMIT %(shelf_limit)s
+),
+by_author AS (
+    SELECT b.id, {by_author} AS source, 0 AS score
+    FROM library_book b
+    WHERE b.author_id IN (SELECT author_id FROM favorite_book)
+      AND b.id NOT IN (SELECT book_id FROM favorite)
+      AND b.language IN (SELECT language FROM favorite_book)
+    ORDER BY b.average_rating DESC, b.ratings_count DESC
+    LIMIT 1
+),
+by_series AS (
+    SELECT b.id, {by_series} AS source, 0 AS score
+    FROM library_book b
+    WHERE b.series_id IN (SELECT series_id FROM favorite_book)
+      AND b.id NOT IN (SELECT book_id FROM favorite)
+      AND b.language IN (SELECT language FROM favorite_book)
+    ORDER BY b.average_rating DESC, b.ratings_count DESC
+    LIMIT 1
+),
+by_neighbors AS (
+    SELECT b.id, {by_shelves} AS source, SUM(n.score) AS score
+    FROM library_book b
+    JOIN library_bookneighbor n ON n.neighbor_id = b.id
+    WHERE n.book_id IN (SELECT book_id FROM favorite)
+      AND b.id NOT IN (SELECT book_id FROM favorite)
+      AND NOT (b.author_id IN (SELECT author_id FROM favorite_book)
+               AND b.author_id IS NOT NULL)
+      AND b.language IN (SELECT language FROM favorite_book)
+    GROUP BY b.id, b.average_rating, b.ratings_count
+    ORDER BY score DESC, b.average_rating DESC, b.ratings_count DESC
+    LIMIT %(candidate_limit)s
+),
+by_popular_shelves AS (
+    SELECT b.id, {by_shelves} AS source, COUNT(*) AS score
+    FROM library_book b
+    JOIN library_bookshelf bs ON bs.book_id = b.id
+    WHERE bs.shelf_id IN (SELECT shelf_id FROM popular_shelf)
+      AND b.id NOT IN (SELECT book_id FROM favorite)
+      -- Exclude books by favorite authors to discover new books
+      AND NOT (b.author_id IN (SELECT author_id FROM favorite_book)
+               AND b.author_id IS NOT NULL)
+      AND b.language IN (SELECT language FROM favorite_book)
+      AND NOT EXISTS (SELECT 1 FROM by_neighbors)
+    GROUP BY b.id, b.average_rating, b.ratings_count
+    ORDER BY score DESC, b.average_rating DESC, b.ratings_count DESC
+    LIMIT %(candidate_limit)s
+),
+candidate AS (
+    SELECT * FROM by_author
+    UNION ALL SELECT * FROM by_series
+    UNION ALL SELECT * FROM by_popular_shelves
+    UNION ALL SELECT * FROM by_neighbors
+)
+SELECT b.*, c.source, c.score,
+       ROW_NUMBER() OVER (
+           PARTITION BY c.source
+           ORDER BY c.score DESC, b.average_rating DESC, b.ratings_count DESC
+       ) AS source_rank
+FROM candidate c
+JOIN library_book b ON b.id = c.id
+ORDER BY c.source, source_rank
+""".format(by_author=BY_AUTHOR, by_series=BY_SERIES, by_shelves=BY_SHELVES)
 
-    # Recommendations by series
-    recommendations_by_series = Book.objects.filter(
-        series_id__in=favorite_series_ids
-    ).exclude(
-        id__in=favorite_book_ids
-    ).filter(
-        language__in=favorite_languages
-    ).order_by(
-        '-average_rating',
-        '-ratings_count'
-    )[:1]  # Get 1 recommendation based on series
 
-    recommendations_by_shelves = (
-        Book.objects.filter(
-            bookshelf__shelf__in=popular_shelves
-        )
-        .exclude(
-            id__in=favorite_book_ids
-        )
-        .exclude(
-            # Exclude books by favorite authors to discover new books
-            author_id__in=favorite_authors_id
-        )
-
-        .filter(
-            language__in=favorite_languages
-        )
-        .annotate(
-            shelf_popularity=Coalesce(
-                Count('bookshelf', filter=Q(
-                    bookshelf__shelf__in=popular_shelves)),
-                Value(0)
-            )
-        )
-        .order_by('-shelf_popularity', '-average_rating', '-ratings_count')
-    )[:20]
+def recommend_books(user, limit: int = 5) -> List[Book]:
+    candidates = defaultdict(list)
+    # The statement reads library_favorite, which only the primary is sure
+    # to have up to date; the router would send a Book query to a replica
+    for book in Book.objects.db_manager(PRIMARY).raw(RECOMMENDATION_SQL, {
+        'user_id': user.id,
+        'shelf_limit': 20,
+        'candidate_limit': 20,
+    }):
+        candidates[book.source].append(book)
 
     # Filter to ensure unique authors
     seen_authors = set()
     unique_recommendations_by_shelves = []
-    for book in recommendations_by_shelves:
+    for book in candidates[BY_SHELVES]:
         # Check if the author_id is already in seen_authors
         if book.author_id not in seen_authors:
             seen_authors.add(book.author_id)
@@ -91,12 +117,34 @@ def recommend_books(user, limit: int = 5) -> List[Book]:
             break
 
     # Combine recommendations ensuring unique results
-    recommendations = list(recommendations_by_author) + \
-        list(recommendations_by_series) + \
-        list(unique_recommendations_by_shelves)
+    recommendations = candidates[BY_AUTHOR] + \
+        candidates[BY_SERIES] + \
+        unique_recommendations_by_shelves
 
     # Ensure the number of recommendations does not exceed the limit
     recommendations = list(
         {book.id: book for book in recommendations}.values())[:limit]
 
     return recommendations
+
+
+def ranked_top_shelves(book_ids):
+    """
+    The [name, count] pairs Book.top_shelves holds for each of ``book_ids``,
+    ranked in one windowed query.
+    """
+    top_shelves = {book_id: [] for book_id in book_ids}
+    ranked = (
+        BookShelf.objects.filter(book_id__in=book_ids)
+        .annotate(rank=Window(
+            RowNumber(),
+            partition_by=F('book_id'),
+            order_by=F('count').desc(),
+        ))
+        .filter(rank__lte=TOP_SHELVES_LIMIT)
+        .order_by('book_id', 'rank')
+        .values_list('book_id', 'shelf__name', 'count')
+    )
+    for book_id, shelf_name, count in ranked:
+        top_shelves[book_id].append([shelf_name, count])
+    return top_shelves
@@ -1,12 +1,28 @@
-from django.db import IntegrityError
-from rest_framework import generics, viewsets, status, filters
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from rest_framework import generics, viewsets, status
+from rest_framework.permissions import IsAdminUser, IsAuthenticatedOrReadOnly, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 
-from library.utils import recommend_books
-from .models import Author, Book, Favorite
-from .serializers import AuthorSerializer, BookSerializer, FavoriteSerializer
+from library.caching import (
+    CachedCatalogMixin, bump_favorites_version, recommendation_cache_stats)
+from library.export import EXPORT_CONTENT_TYPES, CatalogExport
+from library.fieldsets import SparseFieldsetMixin
+from library.filters import CatalogFilter, date_range_filters, min_max_filters
+from library.normalize import RATING_STARS, lookup_isbn13
+from library.pagination import CatalogPagination
+from library.renderers import FastJSONRenderer, StreamContentNegotiation
+from library.routers import pin_user
+from library.rows import BookRowSerializer, RowListMixin, RowSerializer
+from library.search import FullTextSearchFilter
+from library.tasks import schedule_recommendations
+from .models import Author, Book, Favorite, FAVORITES_LIMIT, UserRecommendation
+from .serializers import (
+    AuthorSerializer, BookSerializer, BulkFavoriteSerializer,
+    FavoriteSerializer, prefetch_book_relations)
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import AllowAny
 from django.contrib.auth.models import User
@@ -14,19 +30,87 @@ from rest_framework.decorators import api_view, permission_classes
 from django.contrib.auth import authenticate
 
 
-class AuthorViewSet(viewsets.ModelViewSet):
+class AuthorViewSet(CachedCatalogMixin, SparseFieldsetMixin, RowListMixin,
+                    viewsets.ModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    row_serializer = RowSerializer(AuthorSerializer)
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = CatalogPagination
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CachedCatalogMixin, SparseFieldsetMixin, RowListMixin,
+                  viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
+    row_serializer = BookRowSerializer(BookSerializer)
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filterset_fields = ['title', 'author__name']
+    pagination_class = CatalogPagination
     search_fields = ['title', 'authors__name']
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [FullTextSearchFilter, CatalogFilter]
+    # Each filter is served by an index under every ordering, see
+    # QueryPlanTests.test_filtered_listing_queries
+    exact_filters = {
+        'language': 'language',
+        'series_id': 'series_id',
+        # ?format= is taken by REST framework's renderer override
+        'book_format': 'format',
+        'author': 'authors__api_id',
+    }
+    range_filters = {
+        **min_max_filters('average_rating', 'rating', float),
+        'min_ratings_count': ('ratings_count', 'gte', int),
+        **date_range_filters('published_date', 'published'),
+        **date_range_filters('original_published_date', 'original_published'),
+        **{param: bounds
+           for star in RATING_STARS
+           for param, bounds in min_max_filters(
+               f'rating_{star}_count', f'{star}_star').items()},
+    }
+    field_columns = {'shelves': ['top_shelves']}
+    sparse_actions = ('list', 'retrieve', 'by_isbn')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_requested_fields()
+        if (self.action in self.sparse_actions
+                and (fields is None or 'authors' in fields)):
+            queryset = prefetch_book_relations(queryset)
+        return queryset
+
+    @action(detail=False, url_path=r'by-isbn/(?P<isbn>[0-9Xx-]+)')
+    def by_isbn(self, request, isbn=None):
+        """The book with an ISBN-13, or ISBN-10, of ``isbn``."""
+        isbn13 = lookup_isbn13(isbn)
+        book = isbn13 and (self.get_queryset()
+                           .filter(normalized_isbn13=isbn13)
+                           .order_by('id').first())
+        if not book:
+            raise NotFound('No book has this ISBN.')
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=False, permission_classes=[IsAuthenticated],
+            url_path=r'export/(?P<export_format>{})'.format(
+                '|'.join(EXPORT_CONTENT_TYPES)),
+            renderer_classes=[FastJSONRenderer],
+            content_negotiation_class=StreamContentNegotiation)
+    def export(self, request, export_format=None):
+        """
+        The whole catalog, or the books matching the list filters, streamed
+        as NDJSON or CSV. ``?gzip=1`` compresses it. The URL picks the
+        format, Accept is not checked against it.
+        """
+        export = CatalogExport(
+            export_format,
+            compress=request.query_params.get('gzip') in ('1', 'true'),
+            queryset=self.filter_queryset(self.get_queryset()))
+        response = StreamingHttpResponse(
+            export, content_type=export.content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{export.filename}"')
+        return response
 
 
 class FavoriteViewSet(viewsets.ModelViewSet):
@@ -39,22 +123,117 @@ class FavoriteViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        schedule_recommendations(self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        schedule_recommendations(self.request.user)
 
     def create(self, request, *args, **kwargs):
         # Check if the user already has a favorite
-        if Favorite.objects.filter(user=request.user).count() >= 20:
-            return Response({'detail': 'You can only have up to 20 favorite.'}, status=status.HTTP_400_BAD_REQUEST)
+        if Favorite.objects.filter(user=request.user).count() >= FAVORITES_LIMIT:
+            return Response({'detail': f'You can only have up to {FAVORITES_LIMIT} favorite.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             response = super().create(request, *args, **kwargs)
-            recommendations = recommend_books(request.user)
-            book_serializer = BookSerializer(recommendations, many=True)
-            response.data['recommendations'] = book_serializer.data
+            # Recommendations are computed in the background and served by
+            # the recommendations endpoint
+            response.data['recommendations_status'] = UserRecommendation.Status.PENDING
             return response
 
         except IntegrityError:
             return Response({'detail': 'This book is already your favorite.'}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Add and remove several favorites in one transaction, with a status
+        per book. The favorites limit is checked once for the whole
+        request, and recommendations are recomputed once.
+        """
+        serializer = BulkFavoriteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data['add']
+        remove = serializer.validated_data['remove']
+        user = request.user
+
+        with transaction.atomic():
+            favorites = Favorite.objects.filter(user=user)
+            current = set(favorites.values_list('book_id', flat=True))
+            found = set(Book.objects.filter(id__in=add)
+                        .values_list('id', flat=True))
+            removed = [book_id for book_id in remove if book_id in current]
+            added = [book_id for book_id in add
+                     if book_id in found and book_id not in current]
+
+            total = len(current) - len(removed) + len(added)
+            if total > FAVORITES_LIMIT:
+                return Response(
+                    {'detail': f'You can only have up to {FAVORITES_LIMIT} '
+                               f'favorite, this would make {total}.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+            if removed:
+                favorites.filter(book_id__in=removed).delete()
+            if added:
+                Favorite.objects.bulk_create(
+                    [Favorite(user=user, book_id=book_id) for book_id in added],
+                    ignore_conflicts=True)
+                # bulk_create skips the signals that do this per favorite
+                bump_favorites_version(user.id)
+                pin_user(user.id)
+            if removed or added:
+                schedule_recommendations(user)
+
+        results = [
+            {'book': book_id, 'action': 'add',
+             'status': ('not_found' if book_id not in found
+                        else 'exists' if book_id in current else 'added')}
+            for book_id in add
+        ] + [
+            {'book': book_id, 'action': 'remove',
+             'status': 'removed' if book_id in current else 'not_found'}
+            for book_id in remove
+        ]
+        recommendation = UserRecommendation.objects.filter(user=user).first()
+        return Response({
+            'results': results,
+            'recommendations_status': (
+                recommendation.status if recommendation is not None
+                else None),
+        })
+
+    @action(detail=False, methods=['get'])
+    def recommendations(self, request):
+        recommendation = UserRecommendation.objects.filter(
+            user=request.user).first()
+        if recommendation is None:
+            schedule_recommendations(request.user)
+            return Response({
+                'status': UserRecommendation.Status.PENDING,
+                'updated_at': None,
+                'computed_at': None,
+                'recommendations': [],
+            })
+
+        books = prefetch_book_relations(
+            Book.objects.filter(id__in=recommendation.book_ids))
+        books_by_id = {book.id: book for book in books}
+        ordered_books = [books_by_id[book_id]
+                         for book_id in recommendation.book_ids
+                         if book_id in books_by_id]
+        return Response({
+            'status': recommendation.status,
+            'updated_at': recommendation.updated_at,
+            'computed_at': recommendation.computed_at,
+            'recommendations': BookSerializer(ordered_books, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'], url_path='recommendations/cache-stats',
+            permission_classes=[IsAdminUser])
+    def recommendation_cache_stats(self, request):
+        return Response(recommendation_cache_stats())
+
 
 class RegisterView(generics.CreateAPIView):
     permission_classes = [AllowAny]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -44,10 +45,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'library.profiling.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'library.routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,12 +79,102 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# SQLite by default. DATABASE_ENGINE=postgresql switches to PostgreSQL,
+# configured by the POSTGRES_* variables and needing psycopg installed.
+# The test suite runs against whichever is selected
+
+if os.environ.get('DATABASE_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'library'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Seconds a connection is kept open between requests, checked
+            # before being reused
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Take the write lock when a transaction starts, a read
+                # lock can't be upgraded while another connection writes
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+
+# Read replicas, a comma separated list of PostgreSQL hosts or SQLite
+# files, e.g. a copy of db.sqlite3 for local testing. Each is added as a
+# replica_<n> alias that catalog reads are spread over, see
+# library/routers.py
+REPLICA_DATABASES = []
+for number, replica in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    location = 'HOST' if DATABASES['default']['ENGINE'].endswith(
+        'postgresql') else 'NAME'
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        location: replica.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['library.routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they wrote something
+REPLICA_PIN_SECONDS = 5
+
+# Pragmas applied to every new SQLite connection, see library/sqlite.py.
+# WAL lets readers carry on while import_books writes
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative sizes are in KiB
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+
+# Pragmas import_books applies on top of SQLITE_PRAGMAS while it runs.
+# synchronous=off would be faster still, but a power loss during an
+# import could then corrupt the database
+SQLITE_BULK_LOAD_PRAGMAS = {
+    'cache_size': -256 * 1024,
+    # Pages the WAL grows to before it is checkpointed
+    'wal_autocheckpoint': 10000,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Version stamps, replica pins and cached responses must be shared by the
+# server processes and the import commands, which run in a process of
+# their own, so the default is a directory on disk. CACHE_BACKEND and
+# CACHE_LOCATION select another shared backend, e.g.
+# django.core.cache.backends.redis.RedisCache when serving from several
+# hosts
+
+CACHE_BACKEND = os.environ.get(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', str(BASE_DIR / 'cache')),
     }
 }
+if CACHE_BACKEND.endswith('FileBasedCache'):
+    # Cached responses add up to more than the default 300 entries
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': 10000}
 
 
 # Password validation
@@ -146,6 +239,43 @@ REST_FRAMEWORK = {
 }
 
 
+# Compute recommendations on a background thread, False runs them inline
+RECOMMENDATIONS_ASYNC = True
+
+# Seconds cached recommendations are kept, None keeps them until a
+# favorite or the catalog changes
+RECOMMENDATION_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Per-request SQL and timing instrumentation, see library/profiling.py.
+# Adds Server-Timing headers and logs a JSON line per request when True
+REQUEST_PROFILING = False
+
+# Statements repeated this many times in a request are logged as N+1
+REQUEST_PROFILING_DUPLICATE_THRESHOLD = 5
+
+# Number of slowest queries included in the log line
+REQUEST_PROFILING_SLOW_QUERIES = 3
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'library.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+# Seconds rendered book and author responses are cached, entries are
+# also replaced whenever the catalog or the object changes
+CATALOG_RESPONSE_CACHE_TIMEOUT = 60 * 60
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=365),